@@ -1,13 +1,69 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import json
 import os
 import re
+import time
 import torch
 from flask_cors import CORS
 
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
 app = Flask(__name__)
 CORS(app)
 
+# Prometheus metrics on /metrics
+# Latency buckets in seconds, from a health check up to a long script: the model runs on the CPU,
+# so one generation takes from a few seconds to several minutes
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+http_requests = Counter('http_requests_total', 'HTTP requests handled', ('method', 'endpoint', 'status'))
+http_request_seconds = Histogram(
+    'http_request_duration_seconds', 'Time to produce an HTTP response', ('endpoint',), buckets=LATENCY_BUCKETS
+)
+http_requests_in_flight = Gauge('http_requests_in_flight', 'HTTP requests being handled')
+http_request_bytes = Counter('http_request_bytes_total', 'Request body bytes received', ('endpoint',))
+http_response_bytes = Counter('http_response_bytes_total', 'Response body bytes sent', ('endpoint',))
+
+def request_endpoint():
+    # The route pattern, not the path, so label values stay bounded
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    request.environ['metrics.start'] = time.perf_counter()
+    http_requests_in_flight.inc()
+
+@app.after_request
+def count_response(response):
+    endpoint = request_endpoint()
+    start = request.environ.get('metrics.start')
+    if start is not None:
+        http_request_seconds.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+    http_requests.labels(method=request.method, endpoint=endpoint, status=response.status_code).inc()
+    http_request_bytes.labels(endpoint=endpoint).inc(request.content_length or 0)
+    # Unknown for streamed bodies without a Content-Length
+    http_response_bytes.labels(endpoint=endpoint).inc(response.content_length or 0)
+    return response
+
+@app.teardown_request
+def finish_request_timer(exc=None):
+    if request.environ.pop('metrics.start', None) is not None:
+        http_requests_in_flight.dec()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+generation_seconds = Histogram(
+    'llm_generation_seconds', 'Time the model took to write one script', buckets=LATENCY_BUCKETS
+)
+generations_in_progress = Gauge('llm_generations_in_progress', 'Scripts the model is writing')
+llm_tokens = Counter('llm_tokens_total', 'Tokens processed by the model', ('kind',))
+extraction_seconds = Histogram(
+    'json_extraction_seconds', 'Time to extract the scene JSON from the model output',
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+)
+parse_requests = Counter('scene_parse_requests_total', 'Parse requests by outcome', ('outcome',))
+
 # Import llama-cpp-python for GGUF model inference
 from llama_cpp import Llama
 
@@ -411,17 +467,25 @@ def parse_scene():
 
     prompt = build_prompt_zh(user_text)
     # Call the model
-    output = llm(
-      prompt,
-      max_tokens=2048,  # Increased from 4096 for adequate output length
-      stop=["</s>", "```\n\n", "\n\nThe answer"],
-      temperature=0.7,   # Increased from 0.2 for better diversity
-      top_p=0.8,         # Decreased from 0.95 for more focused sampling
-      top_k=20,          # Added for better control
-      min_p=0,           # Added as recommended
-      presence_penalty=1.5,  # Added to suppress repetitive outputs
-      repeat_penalty=1.1  # Added to reduce repetition
-    )
+    generations_in_progress.inc()
+    try:
+        with generation_seconds.time():
+            output = llm(
+              prompt,
+              max_tokens=2048,  # Increased from 4096 for adequate output length
+              stop=["</s>", "```\n\n", "\n\nThe answer"],
+              temperature=0.7,   # Increased from 0.2 for better diversity
+              top_p=0.8,         # Decreased from 0.95 for more focused sampling
+              top_k=20,          # Added for better control
+              min_p=0,           # Added as recommended
+              presence_penalty=1.5,  # Added to suppress repetitive outputs
+              repeat_penalty=1.1  # Added to reduce repetition
+            )
+    finally:
+        generations_in_progress.dec()
+    usage = output.get("usage") or {}
+    llm_tokens.labels(kind='prompt').inc(usage.get("prompt_tokens", 0))
+    llm_tokens.labels(kind='completion').inc(usage.get("completion_tokens", 0))
         
     # Try to extract JSON from the model's output
     response_text = output["choices"][0]["text"]
@@ -430,7 +494,9 @@ def parse_scene():
     print(response_text)
     print("============================== LLM RESPONSE END ==============================")
 
-    scenes = extract_first_valid_json(response_text)
+    with extraction_seconds.time():
+        scenes = extract_first_valid_json(response_text)
+    parse_requests.labels(outcome='succeeded' if scenes else 'invalid_json').inc()
     if not scenes:
         scenes = {"error": "Failed to parse model output", "raw_output": response_text}
 
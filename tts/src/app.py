@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 import os
 import uuid
 from datetime import datetime
@@ -10,9 +10,61 @@ import atexit
 import threading
 import time
 
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
 app = Flask(__name__)
 CORS(app)
 
+# Prometheus metrics on /metrics
+# Latency buckets in seconds, from a health check up to a long line: Edge TTS usually answers
+# within a few seconds, so the buckets are finest there
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 4, 5, 7.5, 10, 15, 30, 60)
+http_requests = Counter('http_requests_total', 'HTTP requests handled', ('method', 'endpoint', 'status'))
+http_request_seconds = Histogram(
+    'http_request_duration_seconds', 'Time to produce an HTTP response', ('endpoint',), buckets=LATENCY_BUCKETS
+)
+http_requests_in_flight = Gauge('http_requests_in_flight', 'HTTP requests being handled')
+http_request_bytes = Counter('http_request_bytes_total', 'Request body bytes received', ('endpoint',))
+http_response_bytes = Counter('http_response_bytes_total', 'Response body bytes sent', ('endpoint',))
+
+def request_endpoint():
+    # The route pattern, not the path, so label values stay bounded
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    request.environ['metrics.start'] = time.perf_counter()
+    http_requests_in_flight.inc()
+
+@app.after_request
+def count_response(response):
+    endpoint = request_endpoint()
+    start = request.environ.get('metrics.start')
+    if start is not None:
+        http_request_seconds.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+    http_requests.labels(method=request.method, endpoint=endpoint, status=response.status_code).inc()
+    http_request_bytes.labels(endpoint=endpoint).inc(request.content_length or 0)
+    # Unknown for streamed bodies without a Content-Length
+    http_response_bytes.labels(endpoint=endpoint).inc(response.content_length or 0)
+    return response
+
+@app.teardown_request
+def finish_request_timer(exc=None):
+    if request.environ.pop('metrics.start', None) is not None:
+        http_requests_in_flight.dec()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+synthesis_seconds = Histogram(
+    'tts_synthesis_seconds', 'Time Edge TTS took to synthesize one request', buckets=LATENCY_BUCKETS
+)
+synthesis_in_progress = Gauge('tts_synthesis_in_progress', 'Edge TTS requests being synthesized')
+tts_requests = Counter('tts_requests_total', 'TTS requests by outcome', ('outcome',))
+text_characters = Counter('tts_text_characters_total', 'Characters of text synthesized')
+audio_bytes = Counter('tts_audio_bytes_total', 'Bytes of MP3 audio produced')
+
 # Store temporary files for cleanup
 temp_files = []
 cleanup_lock = threading.Lock()
@@ -46,6 +98,8 @@ def schedule_cleanup(file_path, delay=300):  # Clean up after 5 minutes
 # Register cleanup on exit
 atexit.register(cleanup_temp_files)
 
+Gauge('tts_temp_files', 'Generated audio files waiting for cleanup').set_function(lambda: len(temp_files))
+
 async def generate_edge_tts(text, voice, output_file):
     """Generate TTS using Edge TTS"""
     try:
@@ -100,13 +154,19 @@ def generate_tts():
         # Generate TTS audio
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
+        synthesis_in_progress.inc()
         try:
-            success = loop.run_until_complete(generate_edge_tts(text, voice, output_file))
+            with synthesis_seconds.time():
+                success = loop.run_until_complete(generate_edge_tts(text, voice, output_file))
         finally:
+            synthesis_in_progress.dec()
             loop.close()
         
         if success and os.path.exists(output_file):
             print(f"TTS generation successful, file size: {os.path.getsize(output_file)} bytes")
+            tts_requests.labels(outcome='succeeded').inc()
+            text_characters.inc(len(text))
+            audio_bytes.inc(os.path.getsize(output_file))
             
             # Schedule cleanup after 5 minutes
             schedule_cleanup(output_file)
@@ -120,6 +180,7 @@ def generate_tts():
             )
         else:
             print("TTS generation failed")
+            tts_requests.labels(outcome='failed').inc()
             # Clean up temp file if generation failed
             with cleanup_lock:
                 if output_file in temp_files:
@@ -1,30 +1,243 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
+from werkzeug.security import safe_join
 from flask_cors import CORS
 import os
 import base64
+import hashlib
 import tempfile
+from collections import OrderedDict
+from contextlib import closing, nullcontext
 from datetime import datetime
 import uuid
 import shutil
-from PIL import Image
-import io
 import numpy as np
 import random
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 # MoviePy 2 imports
-from moviepy.video.VideoClip import VideoClip, ImageClip, ColorClip, TextClip
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip, clips_array, concatenate_videoclips
-from moviepy.video.fx import Resize, Loop
-from moviepy.video.io.VideoFileClip import VideoFileClip
+from moviepy.video.VideoClip import VideoClip
+from moviepy.video.compositing.CompositeVideoClip import clips_array
+
+from audio_timeline import AUDIO_SAMPLE_RATE, AudioTimeline, decode_audio_files, mux_audio, probe_durations
+from asset_cache import asset_cache, image_source_exists, load_image_rgba, source_digest, sprite_bbox
+from expressions import ExpressionBank
+from frame_store import PAYLOAD_STORE_MAX_AGE, PAYLOAD_STORE_MAX_BYTES, frame_store, payload_store
+from frame_encoder import FrameEncoder, combine_stats
+from contact_sheet import IMAGE_FORMATS, SHEET_COLUMNS, contact_sheet, encode_image, thumbnail
+from compositor import (
+    BitmapOverlay, CameraCrop, FaceOverlay, FrameCompositor, Layer, StaticSceneLayer, flatten_layers, with_overlays
+)
+from image_ingest import PayloadImages
+from hls import PLAYLIST_NAME, HlsStream
+from output_retention import OutputRetention
+from profiles import RenderProfile
+from render_profiler import COLLAPSED_SUFFIX, PROFILERS, PSTATS_SUFFIX, profiling
+from segment_cache import SegmentCache, segment_fingerprint
+from stage_timings import STAGES, current as current_timings, recording, stage, timer
+from subtitles import SubtitleRasterizer, resolve_font
+from cost_model import RenderCostModel, render_features
+from jobs import JobTooLarge, QueueFull, RenderCancelled, RenderJobQueue
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
 app = Flask(__name__)
 CORS(app)
 
 VIDEO_WIDTH = 1280
 VIDEO_HEIGHT = 720
+VIDEO_FPS = 24
+
+# Render profiles selectable per /render request. Layout is authored at VIDEO_WIDTH x VIDEO_HEIGHT
+# and scaled to each profile's resolution while compositing:
+#   final - full resolution with the default x264 settings
+#   draft - quarter of the pixels at half the frame rate, encoded as fast as possible, for checking timing
+RENDER_PROFILES = {
+    'final': RenderProfile('final', VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS, preset='medium', crf=23, base_width=VIDEO_WIDTH),
+    'draft': RenderProfile('draft', 640, 360, 12, preset='ultrafast', crf=32, base_width=VIDEO_WIDTH),
+}
+DEFAULT_RENDER_PROFILE = 'final'
+
+OUTPUT_DIR = "/app/src/outputs"
+# Rendered file names are unique, so clients may cache them for a day without revalidating
+OUTPUTS_CACHE_MAX_AGE = 24 * 3600
+# Hand file bodies to a fronting web server via X-Sendfile instead of streaming them from Python.
+# Only for a front end that honors the header, such as Apache with mod_xsendfile or lighttpd;
+# without one, gunicorn (see wsgi.py) already sends whole files with sendfile
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+EXPRESSIONS_DIR = "/app/src/expressions"
+# Character sprite widths: 250px for 3+ characters in a scene, 350px otherwise
+CHARACTER_WIDTHS = (250, 350)
+# Expressions are drawn at a quarter of the sprite width
+FACE_WIDTH_RATIO = 0.25
+# Picked from at random when a storyboard names an expression that does not exist
+FALLBACK_EXPRESSIONS = ("嘲笑", "嚣张", "大笑")
+
+# Compositing engines selectable per /render request:
+#   moviepy - MoviePy clips over a flattened per-scene frame
+#   numpy   - flat layer list blended with premultiplied alpha into one preallocated buffer
+RENDER_ENGINES = ('moviepy', 'numpy')
+DEFAULT_RENDER_ENGINE = 'moviepy'
+
+# Render modes selectable per /render request:
+#   serial   - one process builds storyboards in order and streams their frames through a single encoder
+#   parallel - each storyboard is encoded as a segment on a process pool, then stream-copied together
+#              (segments are cached by fingerprint, so a re-render only encodes storyboards that changed)
+#   streaming - parallel, plus a live HLS playlist that gains each segment, in order, as soon as it is ready
+RENDER_MODES = ('serial', 'parallel', 'streaming')
+DEFAULT_RENDER_MODE = 'serial'
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+# Times a render restarts the segment pool after a worker died (killed for memory, say) before it fails
+SEGMENT_POOL_RETRIES = int(os.environ.get('SEGMENT_POOL_RETRIES', 1))
+# Flattened scenes each segment worker keeps, so a scene is flattened once per worker, not per storyboard
+SCENE_LAYERS_CACHED = int(os.environ.get('SCENE_LAYERS_CACHED', 4))
+
+# Preview stills are composited as if each storyboard lasted this long, which only affects camera moves
+PREVIEW_DURATION = 1.0
+# Width of each storyboard on a preview contact sheet
+PREVIEW_SHEET_WIDTH = 320
+PREVIEW_MAX_COLUMNS = 16
+
+# Bump when a change to the renderer alters segment pixels, so cached segments are not reused
+SEGMENT_FORMAT_VERSION = 4
+
+# Resolve the subtitle font once; rendered subtitles are cached by text, font, size and color
+subtitle_rasterizer = SubtitleRasterizer(resolve_font())
+
+# Renders run in the background on a fixed-size pool; POST /render only queues them,
+# shortest estimated render first, and refuses them when the estimated backlog is too long
+render_queue = RenderJobQueue()
+# Estimates render time before a job is queued, calibrated by the renders that finish
+cost_model = RenderCostModel()
+
+# Old renders are evicted by last access and total size so the outputs directory can't fill the disk
+output_retention = OutputRetention(OUTPUT_DIR)
+# Likewise for the payload images segment workers map; one is kept while renders keep using it
+payload_retention = OutputRetention(
+    payload_store.directory, PAYLOAD_STORE_MAX_BYTES, PAYLOAD_STORE_MAX_AGE, label='payload image'
+)
+
+# Segments of parallel renders are cached by fingerprint, so re-renders only encode what changed
+segment_cache = SegmentCache()
+
+# Parallel renders run on a process pool, started on first use and replaced if a worker dies.
+# Its workers come from a forkserver, a clean single-threaded process, never from this threaded one:
+# a worker forked from a render thread would inherit other renders' ffmpeg pipes and keep them open,
+# so those encoders would never see end of input
+segment_pool = None
+segment_pool_lock = threading.Lock()
+# Per worker process: scene layers by scene_layers_key
+worker_scene_layers = OrderedDict()
+
+# Prometheus metrics on /metrics. Cache numbers are this process's: parallel renders also
+# load assets in the segment pool's workers, which keep caches of their own
+# Latency buckets in seconds, from a job status poll or a cached asset up to a long render
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+http_requests = Counter('http_requests_total', 'HTTP requests handled', ('method', 'endpoint', 'status'))
+http_request_seconds = Histogram(
+    'http_request_duration_seconds', 'Time to produce an HTTP response', ('endpoint',), buckets=LATENCY_BUCKETS
+)
+http_requests_in_flight = Gauge('http_requests_in_flight', 'HTTP requests being handled')
+http_request_bytes = Counter('http_request_bytes_total', 'Request body bytes received', ('endpoint',))
+http_response_bytes = Counter('http_response_bytes_total', 'Response body bytes sent', ('endpoint',))
+
+def request_endpoint():
+    # The route pattern, not the path, so label values stay bounded
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    request.environ['metrics.start'] = time.perf_counter()
+    http_requests_in_flight.inc()
+
+@app.after_request
+def count_response(response):
+    endpoint = request_endpoint()
+    start = request.environ.get('metrics.start')
+    if start is not None:
+        http_request_seconds.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+    http_requests.labels(method=request.method, endpoint=endpoint, status=response.status_code).inc()
+    http_request_bytes.labels(endpoint=endpoint).inc(request.content_length or 0)
+    # Unknown for streamed bodies without a Content-Length
+    http_response_bytes.labels(endpoint=endpoint).inc(response.content_length or 0)
+    return response
+
+@app.teardown_request
+def finish_request_timer(exc=None):
+    if request.environ.pop('metrics.start', None) is not None:
+        http_requests_in_flight.dec()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+render_seconds = Histogram(
+    'render_duration_seconds', 'Wall time of a render job', ('mode', 'profile'), buckets=LATENCY_BUCKETS
+)
+render_stage_seconds = Histogram(
+    'render_stage_seconds', 'Time one render spent in each stage, summed over segment workers', ('stage',),
+    buckets=LATENCY_BUCKETS
+)
+ingest_seconds = Histogram('render_ingest_seconds', 'Time to decode the images of a /render request', buckets=LATENCY_BUCKETS)
+render_jobs = Counter('render_jobs_total', 'Finished render jobs', ('status',))
+render_frames = Counter('render_frames_encoded_total', 'Frames encoded', ('profile',))
+render_output_bytes = Counter('render_output_bytes_total', 'Bytes of rendered video written')
+cost_estimate_ratio = Histogram(
+    'render_cost_estimate_ratio', 'Measured render time over the cost model\'s estimate', ('mode',),
+    buckets=(0.25, 0.5, 0.67, 0.8, 0.9, 1.1, 1.25, 1.5, 2, 4)
+)
+Gauge('render_backlog_estimated_seconds', 'Estimated seconds of render work queued or running').set_function(
+    lambda: render_queue.stats()['backlog_seconds']
+)
+Gauge('render_outputs_bytes', 'Bytes of rendered videos on disk').set_function(lambda: output_retention.stats()['bytes'])
+encoder_wait_seconds = Counter(
+    'render_encoder_wait_seconds_total',
+    'Time compositing waited on a full encoder queue (side="compositor") or the encoder waited for frames (side="encoder")',
+    ('side',)
+)
 
-def apply_camera_movement(clip, movement_type, duration, target_position='center'):
+def cache_stats():
+    return {
+        'asset': asset_cache.stats(), 'subtitle': subtitle_rasterizer.stats(), 'segment': segment_cache.stats(),
+        'frame_store': frame_store.stats(), 'payload_store': payload_store.stats(),
+    }
+
+class RenderStateCollector:
+    """Reads the queue depth and cache numbers, which the queue and caches already keep, on every scrape"""
+
+    def collect(self):
+        stats = render_queue.stats()
+        queue_jobs = GaugeMetricFamily('render_queue_jobs', 'Render jobs waiting or running', labels=('state',))
+        queue_jobs.add_metric(('queued',), stats['queued'])
+        queue_jobs.add_metric(('running',), stats['running'])
+        yield queue_jobs
+        
+        hits = CounterMetricFamily('render_cache_hits', 'Cache hits', labels=('cache',))
+        misses = CounterMetricFamily('render_cache_misses', 'Cache misses', labels=('cache',))
+        hit_ratio = GaugeMetricFamily('render_cache_hit_ratio', 'Share of cache lookups that hit', labels=('cache',))
+        entries = GaugeMetricFamily('render_cache_entries', 'Entries held in each cache', labels=('cache',))
+        for cache, stats in cache_stats().items():
+            lookups = stats['hits'] + stats['misses']
+            hits.add_metric((cache,), stats['hits'])
+            misses.add_metric((cache,), stats['misses'])
+            hit_ratio.add_metric((cache,), stats['hits'] / lookups if lookups else 0)
+            entries.add_metric((cache,), stats['entries'])
+        yield from (hits, misses, hit_ratio, entries)
+
+REGISTRY.register(RenderStateCollector())
+
+# Map every expression GIF at startup, pre-scaled for each sprite size of every profile,
+# from the frame store; GIFs are only decoded when they are new or changed
+expression_bank = ExpressionBank(EXPRESSIONS_DIR, sorted({
+    int(profile.scaled(width) * FACE_WIDTH_RATIO)
+    for profile in RENDER_PROFILES.values() for width in CHARACTER_WIDTHS
+}), store=frame_store).load()
+
+def apply_camera_movement(clip, movement_type, duration, profile, target_position='center'):
     """Apply camera movement based on the movement type from scene parser, supports English and Chinese"""
     if not movement_type or movement_type == "static" or movement_type == "静止":
         return clip
@@ -97,75 +310,38 @@ def apply_camera_movement(clip, movement_type, duration, target_position='center
     # Zoom in towards the talking character
     zoom_factor = lambda t: min(1.2, 1 + 0.2 * t/duration)
     # zoom_factor = 1.
+    # Pan offsets are in 1280x720 pixels
+    scale = profile.scale
     
     if target_position == 'left':
         # Zoom in and pan towards left character position
-        return (clip.with_effects([Resize(zoom_factor)])
-                .with_position(lambda t: (int(30 * t/duration), int(-10 * t/duration))))
+        offset = lambda t: (int(30 * scale * t/duration), int(-10 * scale * t/duration))
     elif target_position == 'right':
         # Zoom in and pan towards right character position
-        return (clip.with_effects([Resize(zoom_factor)])
-                .with_position(lambda t: (int(-200 * t/duration), int(-20 * t/duration))))
+        offset = lambda t: (int(-200 * scale * t/duration), int(-20 * scale * t/duration))
     else:  # center
         # Zoom in towards center
-        return clip.with_effects([Resize(zoom_factor)]).with_position(lambda t: (0, int(-15 * t/duration)))
+        offset = lambda t: (0, int(-15 * scale * t/duration))
+    
+    # Rather than scaling the whole frame and placing it, crop the visible window
+    # (precomputed per frame) and resample only that to the output size
+    camera = CameraCrop(zoom_factor, offset, duration, profile.fps, profile.size)
+    
+    def move_camera(get_frame, t):
+        frame = get_frame(t)
+        with timer('apply_camera_movement'):
+            return camera.apply(frame, t)
+    moved = clip.transform(move_camera)
+    # transform() copies the scene's frame_key; a moved frame is only the same while the window is too
+    scene_key = getattr(clip, 'frame_key', None)
+    moved.frame_key = scene_key and (lambda t: (scene_key(t), camera.window(t)))
+    return moved
 
-def create_subtitle_clip(text, duration, fontsize=40, color='white', bg_color='black'):
-    """Create a subtitle clip with the given text"""
+def rasterize_subtitle(text, fontsize=40, color='white', bg_color='black', stroke_width=3):
+    """Return the cached (rgb, alpha) bitmap for a subtitle, stroked in bg_color"""
     try:
-        # Use actual font file paths that are available in the Docker container
-        font_options = [
-            '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',      # WenQuanYi Zen Hei
-            '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',    # WenQuanYi Micro Hei
-            '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',  # Noto Sans CJK
-            '/usr/share/fonts/truetype/arphic/ukai.ttc',         # AR PL UKai
-            '/usr/share/fonts/truetype/arphic/uming.ttc',        # AR PL UMing
-            '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',   # DejaVu Sans
-        ]
-        
-        subtitle = None
-        font_used = None
-        
-        # Try each font until one works
-        for font_path in font_options:
-            try:
-                # Check if font file exists
-                if os.path.exists(font_path):
-                    subtitle = TextClip(
-                        text=text,
-                        font_size=fontsize,
-                        color=color,
-                        stroke_color=bg_color,
-                        stroke_width=3,
-                        font=font_path
-                    ).with_duration(duration).with_position(('center', 0.82), relative=True)
-                    font_used = font_path
-                    print(f"Successfully created subtitle with font: {font_used}")
-                    break
-                else:
-                    print(f"Font file not found: {font_path}")
-            except Exception as font_error:
-                print(f"Font {font_path} failed: {font_error}")
-                continue
-        
-        # If no specific font works, try without specifying font
-        if subtitle is None:
-            try:
-                subtitle = TextClip(
-                    text=text,
-                    font_size=fontsize,
-                    color=color,
-                    stroke_color=bg_color,
-                    stroke_width=3
-                ).with_duration(duration).with_position(('center', 0.82), relative=True)
-                font_used = "default system font"
-                print(f"Using default system font for subtitle")
-            except Exception as e:
-                print(f"Default font also failed: {e}")
-                return None
-        
-        return subtitle
-        
+        with stage('subtitle'):
+            return subtitle_rasterizer.render(text, fontsize=fontsize, color=color, stroke_color=bg_color, stroke_width=stroke_width)
     except Exception as e:
         print(f"Error creating subtitle: {e}")
         return None
@@ -210,12 +386,101 @@ def get_character_image_for_scene(character_name, scene):
                 return storyboard.get('character_image', '')
     return ''
 
-def create_scene_clip(scene, scene_characters, scene_background, audio_files, audio_start_index):
-    """Create a complete clip for a scene with all characters present"""
-    scene_clips = []
-    current_audio_index = audio_start_index
+def load_scene_background(scene_background, profile):
+    """Return the scene background as an RGB array at the profile's size, or a flat grey frame"""
+    if image_source_exists(scene_background):
+        try:
+            print(f"      Loading background: {scene_background}")
+            # Decoded and resized once, then shared through the asset cache
+            background_rgba = load_image_rgba(scene_background, size=profile.size)
+            print(f"      Background loaded successfully")
+            return background_rgba[:, :, :3]
+        except Exception as e:
+            print(f"Error loading background {scene_background}: {e}")
+    
+    print(f"      Using default background")
+    return np.full((profile.height, profile.width, 3), 50, dtype=np.uint8)
+
+def get_character_layout(scene, scene_characters, profile):
+    """Load every scene character's sprite and work out where it and its face are drawn"""
+    layout = []
+    # Resize character with closer spacing
+    char_width = profile.scaled(CHARACTER_WIDTHS[0] if len(scene_characters) > 2 else CHARACTER_WIDTHS[1])
+    
+    for char_index, character_name in enumerate(scene_characters):
+        character_image_path = get_character_image_for_scene(character_name, scene)
+        if not image_source_exists(character_image_path):
+            continue
+        
+        try:
+            print(f"        Loading character {character_name}: {character_image_path}")
+            # Load base character image, already resized, from the asset cache
+            character_rgba = load_image_rgba(character_image_path, width=char_width)
+        except Exception as e:
+            print(f"Error loading character {character_name}: {e}")
+            continue
+        
+        # Position characters closer together, standing on the bottom edge
+        position = get_character_position(char_index, len(scene_characters))
+        if position == 'left':
+            x = profile.width * 0.25
+        elif position == 'right':
+            x = profile.width * 0.5
+        else:  # center
+            x = (profile.width - character_rgba.shape[1]) / 2
+        y = profile.height - character_rgba.shape[0]
+        
+        layout.append({
+            'name': character_name,
+            'image': character_rgba,
+            'position': position,
+            'x': int(x),
+            'y': int(y),
+            # Face area is roughly the top 40% and center 60% of character
+            # Adjust these offsets based on your character image layout
+            'face_x': int(x + char_width * 0.4),
+            'face_y': int(y + char_width * 0.25),
+            'face_width': int(char_width * FACE_WIDTH_RATIO),
+            # Only this part of the sprite is blended; the rest is fully transparent
+            'bbox': sprite_bbox(character_image_path, character_rgba),
+        })
+        print(f"        Character {character_name} loaded successfully at position {position}")
     
-    print(f"Creating scene with characters: {scene_characters}")
+    return layout
+
+def get_face_overlays(character_layout, storyboard):
+    """Pick the storyboard's expression for every character and pin it on their face"""
+    faces = []
+    for character in character_layout:
+        expression_name = storyboard.get('expression', '嘲笑')
+        if not expression_bank.has(expression_name):
+            # Fallback: randomly select from available expressions
+            expression_name = random.choice(FALLBACK_EXPRESSIONS)
+        
+        if not expression_bank.has(expression_name):
+            print(f"        Default expression not available: {expression_name}")
+            continue
+        
+        try:
+            # Frames are looked up by time, so the expression loops for the whole duration
+            expression = expression_bank.get(expression_name, character['face_width'])
+            faces.append(FaceOverlay(expression, character['face_x'], character['face_y']))
+            print(f"        Expression {expression_name} applied to {character['name']}")
+        except Exception as e:
+            print(f"        Error applying expression {expression_name}: {e}")
+    return faces
+
+def get_subtitle_position(subtitle_width, profile):
+    """Top-left corner of a subtitle centered horizontally at 82% of the frame height"""
+    return (profile.width - subtitle_width) / 2, profile.height * 0.82
+
+def plan_scene_storyboards(scene, scene_characters, audio_files, audio_start_index):
+    """Pair each storyboard of a scene with its audio file and camera move, in render order.
+
+    With audio_files None every storyboard is planned, without audio, as for a preview.
+    """
+    storyboard_plans = []
+    current_audio_index = audio_start_index
     
     for sub_scene_idx, sub_scene in enumerate(scene.get('sub_scenes', [])):
         camera_movement = sub_scene.get('camera_movement', 'static')
@@ -224,15 +489,17 @@ def create_scene_clip(scene, scene_characters, scene_background, audio_files, au
         for storyboard_idx, storyboard in enumerate(sub_scene.get('storyboards', [])):
             print(f"      Processing storyboard {storyboard_idx}, audio_index: {current_audio_index}")
             
-            if current_audio_index >= len(audio_files):
-                print(f"Warning: No more audio files available")
-                break
-            
-            audio_file = audio_files[current_audio_index]
-            if not os.path.exists(audio_file):
-                print(f"Audio file not found: {audio_file}")
-                current_audio_index += 1
-                continue
+            audio_file = None
+            if audio_files is not None:
+                if current_audio_index >= len(audio_files):
+                    print(f"Warning: No more audio files available")
+                    break
+                
+                audio_file = audio_files[current_audio_index]
+                if not os.path.exists(audio_file):
+                    print(f"Audio file not found: {audio_file}")
+                    current_audio_index += 1
+                    continue
             
             # Get the speaking character for this storyboard to determine camera target
             speaking_character = storyboard.get('character', '').strip()
@@ -251,280 +518,817 @@ def create_scene_clip(scene, scene_characters, scene_background, audio_files, au
                 camera_target_position = 'center'
                 print(f"      Narrator speaking, camera static")
             
-            # Load audio to get duration
-            try:
-                audio_clip = AudioFileClip(audio_file)
-                duration = max(0.5, audio_clip.duration)
-                print(f"      Audio duration: {duration}s")
-            except Exception as e:
-                print(f"Error loading audio file {audio_file}: {e}")
-                duration = 3.0
-                audio_clip = None
-            
-            # Create background clip
-            background = None
-            if scene_background and os.path.exists(scene_background):
-                try:
-                    print(f"      Loading background: {scene_background}")
-                    background = ImageClip(scene_background).with_duration(duration)
-                    background = background.with_effects([Resize((VIDEO_WIDTH, VIDEO_HEIGHT))])
-                    print(f"      Background loaded successfully")
-                except Exception as e:
-                    print(f"Error loading background {scene_background}: {e}")
-                    background = None
-            
-            if background is None:
-                print(f"      Using default background")
-                background = ColorClip(size=(VIDEO_WIDTH, VIDEO_HEIGHT), color=(50, 50, 50)).with_duration(duration)
-            
-            # Create character clips for all scene characters - closer positioning
-            character_clips = []
-            
-            for char_index, character_name in enumerate(scene_characters):
-                character_image_path = get_character_image_for_scene(character_name, scene)
-                
-                if character_image_path and os.path.exists(character_image_path):
-                    try:
-                        print(f"        Loading character {character_name}: {character_image_path}")
-                        
-                        # Load base character image
-                        character = ImageClip(character_image_path).with_duration(duration)
-                        
-                        # Resize character with closer spacing
-                        char_width = 250 if len(scene_characters) > 2 else 350
-                        character = character.with_effects([Resize(width=char_width)])
-                        
-                        # Get expression for the speaking character in this storyboard
-                        expression_name = "嘲笑"  # Default expression
-                        speaking_character = storyboard.get('character', '').strip()
-                        
-                        expression_name = storyboard.get('expression', '嘲笑')
-                        expression_gif_path = f"/app/src/expressions/{expression_name}.gif"
-                        if not os.path.exists(expression_gif_path):
-                            # Fallback: randomly select from available expressions
-                            fallback_expressions = ["嘲笑.gif", "嚣张.gif", "大笑.gif"]
-                            random_expr = random.choice(fallback_expressions)
-                            expression_gif_path = f"/app/src/expressions/{random_expr}"
-                        
-                        if os.path.exists(expression_gif_path):
-                            try:
-                                print(f"        Loading expression: {expression_gif_path}")                                
-                        
-                                # This character is speaking, anime their expression
-                                if speaking_character == character_name:
-                                    # Load expression GIF and loop it for the duration
-                                    expression_clip = VideoFileClip(expression_gif_path, fps_source='tbr', has_mask = True)
-                                else:
-                                    expression_clip = VideoFileClip(expression_gif_path, has_mask = True)
-
-                                # Get the original GIF duration
-                                gif_duration = expression_clip.duration
-                                # Loop the GIF to match the audio duration
-                                if duration > gif_duration:
-                                    # Calculate how many loops we need
-                                    loops_needed = int(duration / gif_duration) + 1
-                                    expression_clip = expression_clip.with_effects([Loop(n=loops_needed)]).with_duration(duration)
-                                
-                                # Resize expression to fit on character's face area
-                                # Assuming face area is roughly the top 40% and center 60% of character
-                                face_width = int(char_width * 0.25)
-                                expression_clip = expression_clip.with_effects([Resize(width=face_width)])
-                                
-                                # Position expression on character's face area
-                                # Adjust these offsets based on your character image layout
-                                face_offset_x = char_width * 0.4  # 20% from left edge
-                                face_offset_y = char_width * 0.25  # 10% from top
-                                expression_clip = expression_clip.with_position((face_offset_x, face_offset_y))
-                                
-                                # Composite character base with expression
-                                character = CompositeVideoClip([character, expression_clip])
-                                print(f"        Expression applied successfully")
-                                
-                            except Exception as e:
-                                print(f"        Error loading expression {expression_gif_path}: {e}")
-                        else:
-                            print(f"        Default expression file not found: {expression_gif_path}")
-                        
-                        # Position characters closer together
-                        position = get_character_position(char_index, len(scene_characters))
-                        if position == 'left':
-                            # Closer to center
-                            character = character.with_position((VIDEO_WIDTH * 0.25, 'bottom'))
-                        elif position == 'right':
-                            # Closer to center
-                            character = character.with_position((VIDEO_WIDTH * 0.5, 'bottom'))
-                        else:  # center
-                            character = character.with_position(('center', 'bottom'))
-                        
-                        character_clips.append(character)
-                        print(f"        Character {character_name} loaded successfully at position {position}")
-                        
-                    except Exception as e:
-                        print(f"Error loading character {character_name}: {e}")
-            
-            # Composite background and characters into a static scene
-            static_scene_clips = [background] + character_clips
-            static_scene = CompositeVideoClip(static_scene_clips)
-            
-            # Apply camera movement to the entire static scene
-            video_with_camera = apply_camera_movement(static_scene, camera_movement, duration, camera_target_position)
-            
-            # Add subtitle
-            dialogue_line = storyboard.get('line', '')
-            character_name = storyboard.get('character', '')
-            subtitle_text = f"{character_name}: {dialogue_line}" if character_name.lower() not in ['narrator', '旁白'] else dialogue_line
-            
-            if subtitle_text.strip():
-                print(f"        Adding subtitle: {subtitle_text[:50]}...")
-                # Use larger font size for better readability
-                subtitle = create_subtitle_clip(subtitle_text, duration, fontsize=40)
-                if subtitle:
-                    video_with_camera = CompositeVideoClip([video_with_camera, subtitle])
-            
-            # Attach audio
-            if audio_clip:
-                video_with_camera = video_with_camera.with_audio(audio_clip)
-                print(f"        Audio attached")
-            
-            scene_clips.append(video_with_camera)
+            storyboard_plans.append({
+                'storyboard': storyboard,
+                'audio_file': audio_file,
+                'audio_index': current_audio_index,
+                'camera_movement': camera_movement,
+                'camera_target_position': camera_target_position,
+            })
             current_audio_index += 1
-            print(f"        Clip created successfully")
     
-    return scene_clips, current_audio_index
+    return storyboard_plans, current_audio_index
 
-def render_video(scenes_data, audio_files, output_file):
-    """Render video with talking head animations, camera moves, and subtitles"""
-    all_clips = []
-    audio_index = 0
+def prepare_scene_layers(scene, scene_characters, scene_background, profile, engine=DEFAULT_RENDER_ENGINE):
+    """Load a scene's sprites at the profile's resolution and flatten the background and character bodies once"""
+    canvas_size = profile.size
+    with stage('asset_load'):
+        character_layout = get_character_layout(scene, scene_characters, profile)
+        background_rgb = load_scene_background(scene_background, profile)
+    scene_layers = {'engine': engine, 'profile': profile, 'character_layout': character_layout}
+    sprites = [trim_sprite(character) for character in character_layout]
+    sprites = [sprite for sprite in sprites if sprite is not None]
     
-    print(f"Starting video render with {len(scenes_data.get('scenes', []))} scenes")
+    with stage('composite'):
+        if engine == 'numpy':
+            scene_layers['base_layer'] = FrameCompositor(
+                [Layer.from_rgb(background_rgb, canvas_size)] +
+                [Layer.from_rgba(rgba, x, y, canvas_size) for rgba, x, y in sprites],
+                canvas_size
+            ).flatten()
+        else:
+            scene_layers['static_layer'] = StaticSceneLayer(flatten_layers(background_rgb, sprites))
+    return scene_layers
+
+def trim_sprite(character):
+    """A laid-out character's sprite cropped to its alpha bounding box, as (rgba, x, y), or None if it is empty"""
+    if character['bbox'] is None:
+        return None
+    x0, y0, x1, y1 = character['bbox']
+    return character['image'][y0:y1, x0:x1], character['x'] + x0, character['y'] + y0
+
+def create_storyboard_clip(storyboard_plan, scene_layers):
+    """Create the clip for one planned storyboard on top of its scene's prepared layers"""
+    profile = scene_layers['profile']
+    canvas_size = profile.size
+    storyboard = storyboard_plan['storyboard']
+    camera_movement = storyboard_plan['camera_movement']
+    camera_target_position = storyboard_plan['camera_target_position']
+    # Set from the decoded dialogue; the audio itself is muxed once for the whole video
+    duration = storyboard_plan['duration']
+    
+    faces = get_face_overlays(scene_layers['character_layout'], storyboard)
+    
+    # Add subtitle
+    dialogue_line = storyboard.get('line', '')
+    character_name = storyboard.get('character', '')
+    subtitle_text = f"{character_name}: {dialogue_line}" if character_name.lower() not in ['narrator', '旁白'] else dialogue_line
+    
+    subtitle = None
+    if subtitle_text.strip():
+        print(f"        Adding subtitle: {subtitle_text[:50]}...")
+        # Use larger font size for better readability
+        subtitle = rasterize_subtitle(subtitle_text, fontsize=profile.scaled(40), stroke_width=profile.scaled(3))
+    
+    # With a static camera the subtitle is drawn straight into the scene frame,
+    # otherwise it goes on top after the camera move
+    static_camera = not camera_movement or camera_movement in ("static", "静止")
+    scene_subtitle = subtitle if static_camera else None
+    
+    if scene_layers['engine'] == 'numpy':
+        # Flat layer list: flattened background and sprites, faces, subtitle
+        layers = [scene_layers['base_layer']] + [
+            Layer.from_animation(face.animation, face.x, face.y, canvas_size) for face in faces
+        ]
+        if scene_subtitle:
+            rgb, alpha = scene_subtitle
+            layers.append(Layer.from_rgb_alpha(rgb, alpha, *get_subtitle_position(rgb.shape[1], profile), canvas_size))
+        static_scene = FrameCompositor(layers, canvas_size).make_clip(duration)
+    else:
+        # Nothing moves but the faces and the subtitle band, so blit just those per frame
+        subtitle_band = None
+        if scene_subtitle:
+            rgb, alpha = scene_subtitle
+            subtitle_band = (rgb, alpha, *get_subtitle_position(rgb.shape[1], profile))
+        static_scene = scene_layers['static_layer'].make_clip(faces, duration, subtitle=subtitle_band)
+    
+    # Only the expressions move within the scene, so frames showing the same expression frames are identical
+    static_scene.frame_key = lambda t: tuple(face.animation.frame_index(t) for face in faces)
+    if static_camera:
+        video_with_camera = static_scene
+    else:
+        # Apply camera movement to the entire static scene, then blit the subtitle on top
+        video_with_camera = apply_camera_movement(static_scene, camera_movement, duration, profile, camera_target_position)
+        if subtitle:
+            rgb, alpha = subtitle
+            x, y = get_subtitle_position(rgb.shape[1], profile)
+            if scene_layers['engine'] == 'numpy':
+                overlay = Layer.from_rgb_alpha(rgb, alpha, x, y, canvas_size)
+            else:
+                overlay = BitmapOverlay(rgb, alpha, x, y)
+            video_with_camera = with_overlays(video_with_camera, [overlay])
     
+    print(f"        Clip created successfully")
+    return video_with_camera
+
+def encode_scene(scene, scene_characters, scene_background, storyboard_plans, encoder, profile, engine=DEFAULT_RENDER_ENGINE, job=None):
+    """Build each storyboard of a scene in turn and stream its frames into encoder.
+
+    A storyboard's clip is closed as soon as its last frame is encoded, and the scene's layers are
+    dropped on return, so memory does not grow with the length of the script.
+    """
+    print(f"Creating scene with characters: {scene_characters} (engine: {engine}, profile: {profile.name})")
+    
+    # Background and character bodies never change within a scene, so flatten them once
+    scene_layers = prepare_scene_layers(scene, scene_characters, scene_background, profile, engine)
+    
+    for plan in storyboard_plans:
+        clip = create_storyboard_clip(plan, scene_layers)
+        try:
+            write_frames(clip, encoder, profile, job=job)
+        finally:
+            try:
+                clip.close()
+            except:
+                pass
+        if job:
+            job.advance('storyboards_done')
+
+def plan_render(scenes_data, audio_files):
+    """Plan every scene's storyboards in render order (all of them, without audio, when audio_files is None).
+
+    Returns a list of (scene, scene_characters, scene_background, storyboard_plans) tuples.
+    """
+    scene_plans = []
+    audio_index = 0
     for scene_idx, scene in enumerate(scenes_data.get('scenes', [])):
         scene_background = scene.get('background', '')
-        print(f"Processing scene {scene_idx}, background: {scene_background}")
-        
-        # Get all characters in this scene
         scene_characters = get_scene_characters(scene)
-        print(f"Scene characters: {scene_characters}")
+        print(f"Planning scene {scene_idx}, characters: {scene_characters}")
         
-        # Create clips for this scene
-        scene_clips, audio_index = create_scene_clip(
-            scene, scene_characters, scene_background, audio_files, audio_index
+        storyboard_plans, audio_index = plan_scene_storyboards(
+            scene, scene_characters, audio_files, audio_index
         )
-        
-        all_clips.extend(scene_clips)
-        print(f"Scene {scene_idx} completed with {len(scene_clips)} clips")
+        scene_plans.append((scene, scene_characters, scene_background, storyboard_plans))
+    return scene_plans
+
+def dialogue_duration(seconds, profile):
+    """How long a storyboard lasts: its dialogue, at least half a second (3s if it could not be read), in whole frames"""
+    duration = 3.0 if seconds is None else max(0.5, seconds)
+    return profile.snap_duration(duration)
+
+def estimate_render(scenes_data, audio_files, profile):
+    """The cost model features of a render, from its plan and its dialogue lengths as the audio headers give them"""
+    storyboards = []
+    plans = []
+    for scene, scene_characters, scene_background, storyboard_plans in plan_render(scenes_data, audio_files):
+        for plan in storyboard_plans:
+            moving = plan['camera_movement'] not in ('', 'static', '静止')
+            plans.append((plan, len(scene_characters), moving))
+    durations = probe_durations([plan['audio_file'] for plan, _, _ in plans])
+    for (plan, characters, moving), seconds in zip(plans, durations):
+        storyboards.append((dialogue_duration(seconds, profile), characters, moving))
+    return render_features(storyboards, profile)
+
+def build_audio_timeline(storyboard_plans, profile, bgm=None):
+    """Decode all dialogue (and the BGM) in one pass and lay it out on a single PCM timeline.
+
+    Sets each plan's 'duration' to its dialogue length, at least half a second and rounded up
+    to whole frames, so the video and the timeline agree on where every storyboard starts.
+    The decoded clips are mapped from disk and each is released once it is placed.
+    """
+    audio_paths = [plan['audio_file'] for plan in storyboard_plans]
+    if bgm:
+        audio_paths.append(bgm['file'])
+    decoded = decode_audio_files(audio_paths)
+    bgm_pcm = decoded.pop() if bgm else None
     
-    if not all_clips:
-        raise Exception("No valid clips were created")
+    for plan, pcm in zip(storyboard_plans, decoded):
+        if pcm is None:
+            print(f"Error loading audio file {plan['audio_file']}, using 3s of silence")
+        plan['duration'] = dialogue_duration(None if pcm is None else len(pcm) / AUDIO_SAMPLE_RATE, profile)
     
-    print(f"Created {len(all_clips)} video clips, concatenating...")
+    timeline = AudioTimeline(sum(plan['duration'] for plan in storyboard_plans))
+    start = 0.0
+    for i, plan in enumerate(storyboard_plans):
+        if decoded[i] is not None:
+            timeline.place(decoded[i], start)
+            decoded[i] = None
+        start += plan['duration']
     
-    # Concatenate all clips
-    final_video = concatenate_videoclips(all_clips, method="compose")
+    if bgm_pcm is not None:
+        print(f"Mixing BGM at volume {bgm['volume']} under {len(storyboard_plans)} lines of dialogue")
+        timeline.mix_bgm(bgm_pcm, volume=bgm['volume'])
+    return timeline
+
+def write_clip(clip, output_file, profile):
+    """Encode a clip's video on its own encoder; returns its frame count and the encoder's stats"""
+    with FrameEncoder(output_file, profile).start() as encoder:
+        frames = write_frames(clip, encoder, profile)
+        with stage('encode'):
+            encoder.close()
+    return frames, encoder.stats()
+
+def write_frames(clip, encoder, profile, job=None):
+    """Produce a clip's frames in order, queueing each for the encoder as soon as it exists.
+
+    The encoder runs alongside, so the 'encode' stage is only the time spent waiting for it.
+    A clip with a frame_key(t) function only has frames composited when the key changes; in
+    between, the last frame is held by repeating it.
+    """
+    frames = profile.frame_count(clip.duration)
+    frame_key = getattr(clip, 'frame_key', None)
+    last_key = None
+    for frame_index in range(frames):
+        t = frame_index / profile.fps
+        key = frame_key(t) if frame_key else None
+        if key is not None and key == last_key:
+            with stage('encode'):
+                encoder.repeat_frame()
+        else:
+            with stage('composite'):
+                frame = clip.get_frame(t)
+                if frame.dtype != np.uint8:
+                    frame = frame.astype(np.uint8)
+            with stage('encode'):
+                encoder.write_frame(frame)
+            last_key = key
+        if job:
+            job.check_cancelled()
+            job.advance('frames_encoded')
+    return frames
+
+def render_segment(segment):
+    """Process pool task: render one storyboard to its own MP4 segment.
+
+    Returns the segment file, its frame count, the worker's stage timings and timers and its encoder's stats.
+    """
+    profile = segment['profile']
+    with recording() as timings, timer('render_segment'):
+        clip = create_storyboard_clip(segment['storyboard_plan'], cached_scene_layers(segment))
+        try:
+            frames, encoder_stats = write_clip(clip, segment['output_file'], profile)
+        finally:
+            try:
+                clip.close()
+            except:
+                pass
+    return segment['output_file'], frames, timings.to_dict(), timings.timers_to_dict(), encoder_stats
+
+def cached_scene_layers(segment):
+    """The segment's scene layers, flattened the first time this worker renders a storyboard of the scene"""
+    key = segment['scene_layers_key']
+    scene_layers = worker_scene_layers.get(key)
+    if scene_layers is None:
+        scene_layers = prepare_scene_layers(
+            segment['scene'], segment['scene_characters'], segment['scene_background'], segment['profile'],
+            segment['engine']
+        )
+        worker_scene_layers[key] = scene_layers
+        while len(worker_scene_layers) > SCENE_LAYERS_CACHED:
+            worker_scene_layers.popitem(last=False)
+    else:
+        worker_scene_layers.move_to_end(key)
+    return scene_layers
+
+def get_segment_pool():
+    """The process pool parallel renders share, started on first use"""
+    global segment_pool
+    with segment_pool_lock:
+        if segment_pool is None:
+            segment_pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context('forkserver')
+            )
+        return segment_pool
+
+def replace_segment_pool(broken_pool):
+    """Drop a pool that lost a worker; the next get_segment_pool() starts a new one"""
+    global segment_pool
+    with segment_pool_lock:
+        if segment_pool is broken_pool:
+            segment_pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+
+def run_segments(segments):
+    """Render segments on the process pool, yielding (segment, render_segment's result) as each finishes.
+
+    A worker that dies breaks the whole pool: it is replaced and the unfinished segments are rendered
+    again, up to SEGMENT_POOL_RETRIES times.
+    """
+    pending = list(segments)
+    retries = 0
+    while pending:
+        pool = get_segment_pool()
+        futures = {}
+        broken = []
+        try:
+            try:
+                for segment in pending:
+                    futures[pool.submit(render_segment, segment)] = segment
+            except BrokenProcessPool:
+                broken = pending[len(futures):]
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken.append(futures[future])
+                    continue
+                yield futures[future], result
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        
+        pending = broken
+        if pending:
+            replace_segment_pool(pool)
+            if retries == SEGMENT_POOL_RETRIES:
+                raise BrokenProcessPool(f"Segment workers died {retries + 1} times, {len(pending)} segments not rendered")
+            retries += 1
+            print(f"A segment worker died; restarting the pool and rendering {len(pending)} segments again")
+
+def concat_segments(segment_files, timeline, output_file):
+    """Join identically encoded segments with ffmpeg's concat demuxer, without re-encoding, and mux the soundtrack"""
+    list_file = os.path.join(os.path.dirname(segment_files[0]), 'segments.txt')
+    with open(list_file, 'w') as f:
+        for segment_file in segment_files:
+            f.write(f"file '{segment_file}'\n")
     
-    print(f"Writing video to: {output_file}")
+    with stage('audio'):
+        mux_audio(['-f', 'concat', '-safe', '0', '-i', list_file], timeline, output_file)
+
+def expression_digests(name):
+    """Content digests of the expression GIFs a storyboard's faces may be drawn from"""
+    names = [name] if expression_bank.has(name) else FALLBACK_EXPRESSIONS
+    return [expression_bank.digest(expression) for expression in names if expression_bank.has(expression)]
+
+def scene_layers_key(segment):
+    """Fingerprint of everything prepare_scene_layers reads for the segment's scene"""
+    return segment_fingerprint({
+        'output': dict(segment['profile'].to_dict(), engine=segment['engine']),
+        'background': source_digest(segment['scene_background']),
+        'characters': [
+            [name, source_digest(get_character_image_for_scene(name, segment['scene']))]
+            for name in segment['scene_characters']
+        ],
+    })
+
+def storyboard_fingerprint(segment):
+    """Fingerprint of everything that goes into a storyboard segment's encoded bytes"""
+    scene = segment['scene']
+    plan = segment['storyboard_plan']
+    storyboard = plan['storyboard']
+    return segment_fingerprint({
+        'format': SEGMENT_FORMAT_VERSION,
+        'output': dict(
+            segment['profile'].to_dict(), codec='libx264', audio_codec='aac', engine=segment['engine']
+        ),
+        'background': source_digest(segment['scene_background']),
+        # Order matters: it decides where each character stands
+        'characters': [
+            [name, source_digest(get_character_image_for_scene(name, scene))]
+            for name in segment['scene_characters']
+        ],
+        'character': storyboard.get('character', ''),
+        'line': storyboard.get('line', ''),
+        'expression': storyboard.get('expression', '嘲笑'),
+        'expression_gifs': expression_digests(storyboard.get('expression', '嘲笑')),
+        'subtitle_font': subtitle_rasterizer.font_path,
+        'audio': source_digest(plan['audio_file']),
+        'camera_movement': plan['camera_movement'],
+        'camera_target_position': plan['camera_target_position'],
+    })
+
+def render_video_parallel(scenes_data, audio_files, output_file, engine=DEFAULT_RENDER_ENGINE, profile=DEFAULT_RENDER_PROFILE, bgm=None, stream_dir=None, job=None):
+    """Render each storyboard as an independent segment on the process pool, then stream-copy them together.
+
+    With stream_dir, finished segments are also published to a live HLS playlist there as they complete.
+    Stage timings recorded by the workers are added to the caller's, so they sum process time, not wall time.
+    """
+    profile = RENDER_PROFILES[profile]
+    scene_plans = plan_render(scenes_data, audio_files)
+    storyboard_plans = [plan for *_, plans in scene_plans for plan in plans]
+    if not storyboard_plans:
+        raise Exception("No valid clips were created")
+    with stage('audio'):
+        timeline = build_audio_timeline(storyboard_plans, profile, bgm)
+    stream = None
+    if stream_dir:
+        stream = HlsStream(stream_dir, timeline, [plan['duration'] for plan in storyboard_plans])
     
-    # Write the final video
-    final_video.write_videofile(
-        output_file, 
-        fps=24,
-        codec='libx264',
-        audio_codec='aac',
-        temp_audiofile='temp-audio.m4a',
-        remove_temp=True,
-        logger=None
-    )
-    
-    print(f"Video saved to: {output_file}")
-    
-    # Clean up
-    for clip in all_clips:
-        try:
-            clip.close()
-        except:
-            pass
+    segments = []
+    segment_dir = tempfile.mkdtemp(prefix='segments_')
+    timings = current_timings()
+    segment_encoder_stats = []
     
     try:
-        final_video.close()
-    except:
-        pass
+        for scene, scene_characters, scene_background, plans in scene_plans:
+            for plan in plans:
+                segment = {
+                    'index': len(segments),
+                    'scene': scene,
+                    'scene_characters': scene_characters,
+                    'scene_background': scene_background,
+                    'storyboard_plan': plan,
+                    'engine': engine,
+                    'profile': profile,
+                    'output_file': os.path.join(segment_dir, f"segment_{len(segments):04d}.mp4"),
+                }
+                segment['fingerprint'] = storyboard_fingerprint(segment)
+                segment['scene_layers_key'] = scene_layers_key(segment)
+                segments.append(segment)
+        
+        # Unchanged storyboards come straight from the segment cache
+        stale = [
+            segment for segment in segments
+            if not segment_cache.fetch(segment['fingerprint'], segment['output_file'])
+        ]
+        reused = len(segments) - len(stale)
+        stale_indexes = {segment['index'] for segment in stale}
+        reused_frames = sum(
+            profile.frame_count(segment['storyboard_plan']['duration'])
+            for segment in segments if segment['index'] not in stale_indexes
+        )
+        print(f"Rendering {len(stale)} segments on {RENDER_WORKERS} workers, reusing {reused} cached segments...")
+        if job:
+            job.update_progress(
+                storyboards_total=len(segments),
+                frames_total=sum(profile.frame_count(plan['duration']) for plan in storyboard_plans)
+            )
+            # Cached segments count as done, so progress reaches 100%
+            job.advance('storyboards_done', reused)
+            job.advance('frames_encoded', reused_frames)
+        
+        # Closing the results cancels the segments not started yet when the render fails or is cancelled
+        with closing(run_segments(stale)) as results:
+            if stream:
+                for segment in segments:
+                    if segment['index'] not in stale_indexes:
+                        with stage('audio'):
+                            stream.add(segment['index'], segment['output_file'])
+            for segment, (_, frames, segment_timings, segment_timers, encoder_stats) in results:
+                segment_encoder_stats.append(encoder_stats)
+                if timings is not None:
+                    timings.merge(segment_timings)
+                    timings.merge_timers(segment_timers)
+                segment_cache.store(segment['fingerprint'], segment['output_file'])
+                if stream:
+                    # Publishing muxes the segment's slice of the soundtrack
+                    with stage('audio'):
+                        stream.add(segment['index'], segment['output_file'])
+                if job:
+                    job.check_cancelled()
+                    job.advance('storyboards_done')
+                    job.advance('frames_encoded', frames)
+                    if stream:
+                        job.update_progress(segments_streamed=stream.published)
+        segment_files = [segment['output_file'] for segment in segments]
+        if stream:
+            stream.finish()
+            if job:
+                job.update_progress(segments_streamed=stream.published)
+        
+        print(f"Concatenating {len(segment_files)} segments with a {timeline.duration:.2f}s soundtrack to: {output_file}")
+        concat_segments(segment_files, timeline, output_file)
+        print(f"Video saved to: {output_file}")
+        return {
+            'segments': len(segments), 'segments_reused': reused, 'frames_reused': reused_frames,
+            'encoder': combine_stats(segment_encoder_stats)
+        }
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+def render_video(scenes_data, audio_files, output_file, engine=DEFAULT_RENDER_ENGINE, mode=DEFAULT_RENDER_MODE, profile=DEFAULT_RENDER_PROFILE, bgm=None, stream_dir=None, job=None):
+    """Render video with talking head animations, camera moves, subtitles and an optional ducked BGM bed.
 
-def save_base64_to_temp_file(base64_data, file_extension='.png'):
-    """Convert base64 data to temporary file and return file path"""
+    bgm is a {'file', 'volume'} dict; stream_dir is where the streaming mode writes its live HLS playlist.
+    When a RenderJob is given, storyboard and frame progress are reported to it and the render stops
+    with RenderCancelled once the job is cancelled. Inside stage_timings.recording(), time spent per
+    stage (asset load, composite, subtitle, audio, encode) is recorded.
+    """
+    if mode in ('parallel', 'streaming'):
+        return render_video_parallel(
+            scenes_data, audio_files, output_file, engine=engine, profile=profile, bgm=bgm,
+            stream_dir=stream_dir if mode == 'streaming' else None, job=job
+        )
+    
+    profile = RENDER_PROFILES[profile]
+    print(f"Starting video render with {len(scenes_data.get('scenes', []))} scenes")
+    
+    scene_plans = plan_render(scenes_data, audio_files)
+    storyboard_plans = [plan for *_, plans in scene_plans for plan in plans]
+    if not storyboard_plans:
+        raise Exception("No valid clips were created")
+    if job:
+        job.update_progress(storyboards_total=len(storyboard_plans))
+    
+    # All audio is decoded, laid out and mixed once, before any video work
+    with stage('audio'):
+        timeline = build_audio_timeline(storyboard_plans, profile, bgm)
+    if job:
+        job.update_progress(frames_total=sum(profile.frame_count(plan['duration']) for plan in storyboard_plans))
+    
+    video_dir = tempfile.mkdtemp(prefix='render_')
+    video_file = os.path.join(video_dir, 'video.mp4')
+    
+    print(f"Writing video to: {output_file}")
+    
     try:
-        if not base64_data:
-            return None
-            
-        print(f"Processing base64 data: {base64_data[:50]}...")
-        
-        # Handle data URL format
-        if base64_data.startswith('data:image'):
-            # Extract the actual base64 part
-            if ',' in base64_data:
-                header, base64_data = base64_data.split(',', 1)
-                print(f"Data URL header: {header}")
-            else:
-                print("Warning: Data URL missing comma separator")
-                return None
+        # Storyboards go through one encoder in order, each built just before its frames are needed
+        with FrameEncoder(video_file, profile).start() as encoder:
+            for scene_idx, (scene, scene_characters, scene_background, plans) in enumerate(scene_plans):
+                print(f"Processing scene {scene_idx}, background: {scene_background}")
+                with timer('encode_scene'):
+                    encode_scene(
+                        scene, scene_characters, scene_background, plans, encoder, profile, engine=engine, job=job
+                    )
+                print(f"Scene {scene_idx} completed with {len(plans)} clips")
+            with stage('encode'):
+                encoder.close()
         
-        # Decode base64 data
-        try:
-            file_data = base64.b64decode(base64_data)
-            print(f"Decoded {len(file_data)} bytes of image data")
-        except Exception as e:
-            print(f"Failed to decode base64 data: {e}")
-            return None
+        # Then mux the soundtrack in alongside the picture
+        with stage('audio'):
+            mux_audio(['-i', video_file], timeline, output_file)
         
-        # Validate it's actually image data by trying to open with PIL
-        try:
-            img = Image.open(io.BytesIO(file_data))
-            print(f"Image validation successful: {img.format} {img.size} {img.mode}")
+        print(f"Video saved to: {output_file}")
+        return {'encoder': encoder.stats()}
+    finally:
+        # Clean up
+        shutil.rmtree(video_dir, ignore_errors=True)
+
+def render_storyboard_stills(scenes_data, profile, engine=DEFAULT_RENDER_ENGINE):
+    """Composite the first frame of every storyboard with the render's own layout code.
+
+    No audio is decoded and nothing is encoded. Returns a list of (storyboard plan, RGB frame).
+    """
+    stills = []
+    for scene, scene_characters, scene_background, plans in plan_render(scenes_data, None):
+        scene_layers = prepare_scene_layers(scene, scene_characters, scene_background, profile, engine)
+        for plan in plans:
+            # The first frame shows the whole layout, before any camera move has begun
+            plan['duration'] = PREVIEW_DURATION
+            clip = create_storyboard_clip(plan, scene_layers)
+            try:
+                # The NumPy engine reuses its frame buffer, so keep a copy
+                stills.append((plan, np.array(clip.get_frame(0), dtype=np.uint8)))
+            finally:
+                try:
+                    clip.close()
+                except:
+                    pass
+    return stills
+
+def ingest_scene_images(scenes, profile):
+    """Swap every base64 background and character image in the scenes for its decoded pixels.
+
+    Each distinct payload is decoded once, on a thread pool, no matter how many storyboards repeat it,
+    and scaled once to the largest size the profile draws it at: backgrounds to the frame size and
+    characters to the widest sprite.
+    """
+    return ingest_episodes([(scenes, profile)])[0]
+
+def ingest_episodes(episodes):
+    """ingest_scene_images for several (scenes, profile) scripts at once, decoding images they share only once"""
+    payload_images = PayloadImages()
+    targets = []
+    processed_episodes = []
+    for scenes, profile in episodes:
+        character_width = profile.scaled(max(CHARACTER_WIDTHS))
+        processed_scenes = []
+        for scene_idx, scene in enumerate(scenes):
+            processed_scene = scene.copy()
             
-            # Keep transparency for PNG images - don't convert to RGB
-            if img.format == 'PNG' and img.mode in ('RGBA', 'LA'):
-                print(f"Preserving transparency for PNG image")
-                # Save as PNG to preserve transparency
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-                img.save(temp_file.name, 'PNG')
-                temp_file.close()
-                print(f"PNG with transparency saved to: {temp_file.name}")
-                return temp_file.name
+            # Handle background image
+            bg_data = processed_scene.get('background', '')
+            if bg_data:
+                targets.append((processed_scene, 'background', payload_images.add(bg_data, size=profile.size), f"scene {scene_idx} background"))
             else:
-                # Convert to RGB for other formats
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    print(f"Converting image from {img.mode} to RGB")
-                    # Create white background
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                    img = background
-                
-                # Save the processed image
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_extension)
-                img.save(temp_file.name, 'PNG', quality=95)
-                temp_file.close()
-                
-                print(f"Image saved to: {temp_file.name}")
-                return temp_file.name
+                print(f"No background data for scene {scene_idx}")
+                processed_scene['background'] = ''
             
-        except Exception as e:
-            print(f"Invalid image data: {e}")
-            return None
+            # Handle character images in storyboards
+            for sub_idx, sub_scene in enumerate(processed_scene.get('sub_scenes', [])):
+                for sb_idx, storyboard in enumerate(sub_scene.get('storyboards', [])):
+                    char_data = storyboard.get('character_image', '')
+                    if char_data:
+                        targets.append((
+                            storyboard, 'character_image', payload_images.add(char_data, width=character_width),
+                            f"scene {scene_idx}, sub {sub_idx}, sb {sb_idx} character image"
+                        ))
+                    else:
+                        storyboard['character_image'] = ''
             
-    except Exception as e:
-        print(f"Error converting base64 to temp file: {e}")
-        return None
+            processed_scenes.append(processed_scene)
+        processed_episodes.append(processed_scenes)
+    
+    payload_images.decode_all()
+    for container, field, key, description in targets:
+        image = payload_images.get(key)
+        if image is None:
+            print(f"Failed to process {description}")
+        container[field] = image or ''
+    return processed_episodes
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy', 'service': 'video-renderer'})
 
+def write_audio_payloads(audio_files_base64, temp_audio_dir, written=None):
+    """Write each base64 audio payload (optionally a data URL) to a file in temp_audio_dir.
+
+    Returns the paths of the payloads that decoded, in order. Identical payloads share one file;
+    pass the same written dict for several payload lists to share files between them.
+    """
+    written = {} if written is None else written
+    temp_audio_files = []
+    for i, audio_base64 in enumerate(audio_files_base64):
+        try:
+            if not audio_base64:
+                continue
+                
+            # Remove data URL prefix if present
+            if ',' in audio_base64:
+                audio_base64 = audio_base64.split(',')[1]
+            
+            payload_key = hashlib.sha1(audio_base64.encode('utf-8')).hexdigest()
+            if payload_key in written:
+                temp_audio_files.append(written[payload_key])
+                continue
+            
+            # Decode base64 audio data
+            audio_data = base64.b64decode(audio_base64)
+            
+            # Create temporary audio file
+            temp_audio_file = os.path.join(temp_audio_dir, f'audio_{len(written):03d}.mp3')
+            with open(temp_audio_file, 'wb') as f:
+                f.write(audio_data)
+            
+            written[payload_key] = temp_audio_file
+            temp_audio_files.append(temp_audio_file)
+            print(f"Created temp audio file: {temp_audio_file} ({len(audio_data)} bytes)")
+            
+        except Exception as e:
+            print(f"Error processing audio file {i}: {e}")
+            continue
+    return temp_audio_files
+
+def write_bgm_payload(bgm, temp_audio_dir):
+    """Write background music, {'fileName', 'fileData' (base64 or data URL), 'volume'}, to temp_audio_dir.
+
+    Returns the {'file', 'volume'} track for render_video, or None.
+    """
+    if not bgm or not bgm.get('fileData'):
+        return None
+    try:
+        bgm_base64 = bgm['fileData']
+        if ',' in bgm_base64:
+            bgm_base64 = bgm_base64.split(',')[1]
+        bgm_data = base64.b64decode(bgm_base64)
+        
+        bgm_ext = os.path.splitext(bgm.get('fileName') or '')[1] or '.mp3'
+        bgm_file = os.path.join(temp_audio_dir, f'bgm_{uuid.uuid4().hex[:8]}{bgm_ext}')
+        with open(bgm_file, 'wb') as f:
+            f.write(bgm_data)
+        
+        bgm_track = {'file': bgm_file, 'volume': float(bgm.get('volume', 0.5))}
+        print(f"Created temp BGM file: {bgm_file} ({len(bgm_data)} bytes, volume {bgm_track['volume']})")
+        return bgm_track
+    except Exception as e:
+        print(f"Error processing BGM: {e}")
+        return None
+
+def render_options_error(engine, mode, profile):
+    """The error message for an unknown engine, mode or profile, or None"""
+    if engine not in RENDER_ENGINES:
+        return f"Unknown engine '{engine}', expected one of {list(RENDER_ENGINES)}"
+    if mode not in RENDER_MODES:
+        return f"Unknown mode '{mode}', expected one of {list(RENDER_MODES)}"
+    if profile not in RENDER_PROFILES:
+        return f"Unknown profile '{profile}', expected one of {list(RENDER_PROFILES)}"
+    return None
+
+def prepare_render_job(processed_scenes, temp_audio_files, bgm_track, engine, mode, profile, profiler=None):
+    """Pick the output paths of a render, estimate its cost and build the run(job) that the render queue executes.
+
+    With a profiler (one of PROFILERS) the render runs under it and its profile is written next to the video.
+    Returns (run_render, stream_url, estimated_seconds, profile_urls), profile_urls being None without a profiler.
+    """
+    # Generate unique filename
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"video_{timestamp}_{uuid.uuid4().hex[:8]}.mp4"
+    
+    # Ensure output directory exists
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_file = os.path.join(OUTPUT_DIR, filename)
+    
+    # The streaming mode publishes a live HLS playlist next to the final MP4
+    stream_dir = stream_url = None
+    if mode == 'streaming':
+        stream_name = os.path.splitext(filename)[0]
+        stream_dir = os.path.join(OUTPUT_DIR, stream_name)
+        stream_url = f"/streams/{stream_name}/{PLAYLIST_NAME}"
+    
+    profile_prefix = profile_urls = None
+    if profiler:
+        profile_prefix = os.path.splitext(output_file)[0]
+        profile_name = os.path.splitext(filename)[0]
+        profile_urls = {'collapsed': f"/outputs/{profile_name}{COLLAPSED_SUFFIX}"}
+        if profiler == 'deterministic':
+            profile_urls['pstats'] = f"/outputs/{profile_name}{PSTATS_SUFFIX}"
+    
+    # Prepare scenes data for the renderer
+    scenes_data = {'scenes': processed_scenes}
+    features = estimate_render(scenes_data, temp_audio_files, RENDER_PROFILES[profile])
+    estimated_seconds = cost_model.estimate(features, f"{mode}/{profile}")
+    print(f"Estimated render time: {estimated_seconds:.1f}s ({features['frame']} frames)")
+    
+    def run_render(job):
+        print(f"Rendering video with {len(processed_scenes)} scenes and {len(temp_audio_files)} audio files")
+        print(f"Output file: {output_file}, engine: {engine}, mode: {mode}, profile: {profile}")
+        
+        try:
+            # Render the video
+            start = time.perf_counter()
+            with recording() as timings, render_seconds.labels(mode=mode, profile=profile).time():
+                with profiling(profile_prefix, profiler) if profiler else nullcontext() as profile_report:
+                    render_stats = render_video(
+                        scenes_data, temp_audio_files, output_file, engine=engine, mode=mode, profile=profile,
+                        bgm=bgm_track, stream_dir=stream_dir, job=job
+                    )
+            wall_seconds = time.perf_counter() - start
+        except BaseException as e:
+            render_jobs.labels(status='cancelled' if isinstance(e, RenderCancelled) else 'failed').inc()
+            # Don't leave a half-written video or stream behind after a failure or cancellation
+            if os.path.isfile(output_file):
+                os.unlink(output_file)
+            if stream_dir:
+                shutil.rmtree(stream_dir, ignore_errors=True)
+            raise
+        
+        render_jobs.labels(status='succeeded').inc()
+        # Calibrate on the render as estimated before the calibration moved
+        cost_estimate_ratio.labels(mode=mode).observe(wall_seconds / estimated_seconds if estimated_seconds else 0)
+        cost_model.observe(features, f"{mode}/{profile}", wall_seconds)
+        for stage_name in STAGES:
+            render_stage_seconds.labels(stage=stage_name).observe(timings.seconds.get(stage_name, 0.0))
+        # Frames of reused segments count toward the job's progress but were not encoded by it
+        render_frames.labels(profile=profile).inc(
+            job.to_dict()['progress']['frames_encoded'] - (render_stats or {}).get('frames_reused', 0)
+        )
+        render_output_bytes.inc(os.path.getsize(output_file))
+        encoder_stats = (render_stats or {}).get('encoder')
+        if encoder_stats:
+            encoder_wait_seconds.labels(side='compositor').inc(encoder_stats['compositor_blocked_seconds'])
+            encoder_wait_seconds.labels(side='encoder').inc(encoder_stats['encoder_starved_seconds'])
+        return {
+            'video_file': f"/outputs/{filename}",
+            'scenes_count': len(processed_scenes),
+            'audio_files_processed': len(temp_audio_files),
+            'engine': engine,
+            'mode': mode,
+            'profile': profile,
+            'bgm': bgm_track is not None,
+            'stream_url': stream_url,
+            'estimated_seconds': round(estimated_seconds, 3),
+            'render_seconds': round(wall_seconds, 3),
+            'timings': {'stages': timings.to_dict(), 'timers': timings.timers_to_dict()},
+            'profile_report': profile_report and {
+                # 'sampling' when a deterministic profile was asked for while another render held cProfile
+                'profiler': profile_report['profiler'],
+                'samples': profile_report['samples'],
+                'urls': {kind: url for kind, url in profile_urls.items() if kind in profile_report['files']},
+            },
+            **(render_stats or {})
+        }
+    
+    return run_render, stream_url, estimated_seconds, profile_urls
+
+def requested_profiler(data, default=None):
+    """The profiler a render asks for with a 'profiler' field or an X-Render-Profiler header, or None.
+
+    true, 1 and 'deterministic' select cProfile plus stack sampling, 'sampling' stack sampling alone.
+    Raises ValueError for anything else.
+    """
+    value = data.get('profiler', request.headers.get('X-Render-Profiler', default))
+    if value in (None, False, '', 0, '0', 'false', 'off'):
+        return None
+    if value in (True, 1, '1', 'true', 'on'):
+        return 'deterministic'
+    if value not in PROFILERS:
+        raise ValueError(f"Unknown profiler '{value}', expected one of {list(PROFILERS)}")
+    return value
+
+def job_links(job, stream_url=None, schedule=None, profile_urls=None):
+    """Where to follow a queued job and find its profile, with its estimated render time and completion"""
+    start, completion = (schedule or {}).get(job.id, (None, None))
+    return {
+        'status': job.status,
+        'job_id': job.id,
+        'status_url': f"/render/jobs/{job.id}",
+        'result_url': f"/render/jobs/{job.id}/result",
+        'stream_url': stream_url,
+        'estimated_seconds': None if job.estimated_seconds is None else round(job.estimated_seconds, 3),
+        'estimated_start_at': start,
+        'estimated_completion_at': completion,
+        'profile_urls': profile_urls,
+    }
+
 @app.route('/render', methods=['POST'])
 def render_video_endpoint():
+    """Accept a render and queue it; progress and the result are available from /render/jobs/<job_id>"""
     temp_files_to_cleanup = []
     temp_dirs_to_cleanup = []
+    handed_off = False
     
     try:
         data = request.json
@@ -536,6 +1340,17 @@ def render_video_endpoint():
         scenes = data['scenes']
         audio_files_base64 = data['audio_files']
         bgm = data.get('bgm')
+        engine = data.get('engine', DEFAULT_RENDER_ENGINE)
+        mode = data.get('mode', DEFAULT_RENDER_MODE)
+        profile = data.get('profile', DEFAULT_RENDER_PROFILE)
+        
+        error = render_options_error(engine, mode, profile)
+        if error:
+            return jsonify({'error': error}), 400
+        try:
+            profiler = requested_profiler(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         print(f"Received {len(scenes)} scenes and {len(audio_files_base64)} audio files")
         
@@ -553,73 +1368,12 @@ def render_video_endpoint():
         temp_dirs_to_cleanup.append(temp_audio_dir)
         
         # Convert base64 audio data to temporary files
-        temp_audio_files = []
-        for i, audio_base64 in enumerate(audio_files_base64):
-            try:
-                if not audio_base64:
-                    continue
-                    
-                # Remove data URL prefix if present
-                if ',' in audio_base64:
-                    audio_base64 = audio_base64.split(',')[1]
-                
-                # Decode base64 audio data
-                audio_data = base64.b64decode(audio_base64)
-                
-                # Create temporary audio file
-                temp_audio_file = os.path.join(temp_audio_dir, f'audio_{i:03d}.mp3')
-                with open(temp_audio_file, 'wb') as f:
-                    f.write(audio_data)
-                
-                temp_audio_files.append(temp_audio_file)
-                print(f"Created temp audio file: {temp_audio_file} ({len(audio_data)} bytes)")
-                
-            except Exception as e:
-                print(f"Error processing audio file {i}: {e}")
-                continue
+        temp_audio_files = write_audio_payloads(audio_files_base64, temp_audio_dir)
+        bgm_track = write_bgm_payload(bgm, temp_audio_dir)
         
-        # Process scenes to convert base64 images to temporary files
-        processed_scenes = []
-        for scene_idx, scene in enumerate(scenes):
-            processed_scene = scene.copy()
-            
-            # Handle background image
-            bg_data = processed_scene.get('background', '')
-            if bg_data:
-                print(f"Processing background image for scene {scene_idx}")
-                temp_bg_file = save_base64_to_temp_file(bg_data, '.png')
-                if temp_bg_file:
-                    processed_scene['background'] = temp_bg_file
-                    temp_files_to_cleanup.append(temp_bg_file)
-                    print(f"Background image saved to: {temp_bg_file}")
-                else:
-                    processed_scene['background'] = ''
-                    print(f"Failed to process background image for scene {scene_idx}")
-            else:
-                print(f"No background data for scene {scene_idx}")
-                processed_scene['background'] = ''
-            
-            # Handle character images in storyboards
-            if 'sub_scenes' in processed_scene:
-                for sub_idx, sub_scene in enumerate(processed_scene['sub_scenes']):
-                    if 'storyboards' in sub_scene:
-                        for sb_idx, storyboard in enumerate(sub_scene['storyboards']):
-                            char_data = storyboard.get('character_image', '')
-                            if char_data:
-                                print(f"Processing character image for scene {scene_idx}, sub {sub_idx}, sb {sb_idx}")
-                                temp_char_file = save_base64_to_temp_file(char_data, '.png')
-                                if temp_char_file:
-                                    storyboard['character_image'] = temp_char_file
-                                    temp_files_to_cleanup.append(temp_char_file)
-                                    print(f"Character image saved to: {temp_char_file}")
-                                else:
-                                    storyboard['character_image'] = ''
-                                    print(f"Failed to process character image for scene {scene_idx}, sub {sub_idx}, sb {sb_idx}")
-                            else:
-                                print(f"No character data for scene {scene_idx}, sub {sub_idx}, sb {sb_idx}")
-                                storyboard['character_image'] = ''
-            
-            processed_scenes.append(processed_scene)
+        # Decode each distinct base64 image once, straight to pixels for the renderer
+        with ingest_seconds.time():
+            processed_scenes = ingest_scene_images(scenes, RENDER_PROFILES[profile])
         
         # Debug: Print processed data
         if processed_scenes:
@@ -631,68 +1385,329 @@ def render_video_endpoint():
                     first_sb = first_sub['storyboards'][0]
                     print(f"First processed storyboard character: {first_sb.get('character_image')}")
         
-        # Generate unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"video_{timestamp}_{uuid.uuid4().hex[:8]}.mp4"
+        run_render, stream_url, estimated_seconds, profile_urls = prepare_render_job(
+            processed_scenes, temp_audio_files, bgm_track, engine, mode, profile, profiler=profiler
+        )
         
-        # Ensure output directory exists
-        output_dir = "/app/src/outputs"
-        os.makedirs(output_dir, exist_ok=True)
-        output_file = os.path.join(output_dir, filename)
+        # The job owns the temp files from here on and cleans them up when it finishes
+        try:
+            job = render_queue.submit(
+                run_render, lambda: cleanup_temp_files(temp_files_to_cleanup, temp_dirs_to_cleanup),
+                estimated_seconds=estimated_seconds
+            )
+        except QueueFull as e:
+            return jsonify({'error': str(e)}), 429
+        except JobTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        handed_off = True
         
-        # Prepare scenes data for the renderer
-        scenes_data = {'scenes': processed_scenes}
+        print(f"Queued render job {job.id}")
+        return jsonify(job_links(job, stream_url, render_queue.schedule(), profile_urls)), 202
         
-        print(f"Rendering video with {len(processed_scenes)} scenes and {len(temp_audio_files)} audio files")
-        print(f"Output file: {output_file}")
+    except Exception as e:
+        print(f"Error in render endpoint: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+    
+    finally:
+        if not handed_off:
+            cleanup_temp_files(temp_files_to_cleanup, temp_dirs_to_cleanup)
+
+@app.route('/render/batch', methods=['POST'])
+def render_batch_endpoint():
+    """Queue several scripts, such as the episodes of a series, as one batch.
+
+    Body: {'episodes': [<a /render payload>, ...]}, plus engine, mode and profile defaults that an
+    episode may override. Images and audio shared between episodes are decoded and written once,
+    the episodes run as separate jobs across the render workers, and /render/batches/<batch_id>
+    reports their combined status and each episode's result. The whole batch is rejected with
+    429 unless every episode fits in the render queue.
+    """
+    temp_dirs_to_cleanup = []
+    handed_off = False
+    
+    try:
+        data = request.json
+        if not data or not isinstance(data.get('episodes'), list) or not data['episodes']:
+            return jsonify({'error': 'Missing episodes parameter'}), 400
+        
+        episodes = []
+        for index, episode in enumerate(data['episodes']):
+            if not isinstance(episode, dict) or 'scenes' not in episode or 'audio_files' not in episode:
+                return jsonify({'error': f'Episode {index} is missing scenes or audio_files'}), 400
+            options = {
+                option: episode.get(option, data.get(option, default))
+                for option, default in (
+                    ('engine', DEFAULT_RENDER_ENGINE), ('mode', DEFAULT_RENDER_MODE), ('profile', DEFAULT_RENDER_PROFILE)
+                )
+            }
+            error = render_options_error(**options)
+            if error:
+                return jsonify({'error': f'Episode {index}: {error}'}), 400
+            try:
+                options['profiler'] = requested_profiler(episode, default=data.get('profiler'))
+            except ValueError as e:
+                return jsonify({'error': f'Episode {index}: {e}'}), 400
+            episodes.append((episode, options))
+        
+        if len(episodes) > render_queue.max_queued:
+            return jsonify({'error': f'Batch has {len(episodes)} episodes, the render queue holds {render_queue.max_queued}'}), 400
+        
+        print(f"Received batch of {len(episodes)} episodes")
+        
+        # One audio directory for the whole batch, so a voice line shared by episodes is written once
+        temp_audio_dir = tempfile.mkdtemp(prefix='audio_batch_')
+        temp_dirs_to_cleanup.append(temp_audio_dir)
+        written_audio = {}
+        episode_audio = [
+            (write_audio_payloads(episode['audio_files'], temp_audio_dir, written_audio),
+             write_bgm_payload(episode.get('bgm'), temp_audio_dir))
+            for episode, _ in episodes
+        ]
+        
+        with ingest_seconds.time():
+            episode_scenes = ingest_episodes([
+                (episode['scenes'], RENDER_PROFILES[options['profile']]) for episode, options in episodes
+            ])
+        
+        # The batch's files are removed once its last episode finishes, however it finishes
+        remaining = [len(episodes)]
+        remaining_lock = threading.Lock()
         
-        # Render the video
-        render_video(scenes_data, temp_audio_files, output_file)
+        def cleanup_episode():
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            cleanup_temp_files([], temp_dirs_to_cleanup)
         
+        runs = []
+        links = []
+        for (episode, options), processed_scenes, (temp_audio_files, bgm_track) in zip(episodes, episode_scenes, episode_audio):
+            run_render, stream_url, estimated_seconds, profile_urls = prepare_render_job(
+                processed_scenes, temp_audio_files, bgm_track, **options
+            )
+            runs.append((run_render, cleanup_episode, estimated_seconds))
+            links.append((stream_url, profile_urls))
+        
+        try:
+            batch = render_queue.submit_batch(runs)
+        except QueueFull as e:
+            return jsonify({'error': str(e)}), 429
+        except JobTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        handed_off = True
+        
+        print(f"Queued render batch {batch.id}: {len(batch.jobs)} jobs")
+        schedule = render_queue.schedule()
         return jsonify({
-            'status': 'success',
-            'video_file': f"/outputs/{filename}",
-            'scenes_count': len(processed_scenes),
-            'audio_files_processed': len(temp_audio_files)
-        })
+            'status': batch.status,
+            'batch_id': batch.id,
+            'status_url': f"/render/batches/{batch.id}",
+            'episodes': [
+                job_links(job, stream_url, schedule, profile_urls)
+                for job, (stream_url, profile_urls) in zip(batch.jobs, links)
+            ]
+        }), 202
         
     except Exception as e:
-        print(f"Error in render endpoint: {e}")
+        print(f"Error in batch render endpoint: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
     
     finally:
-        # Clean up temporary files
-        print("Cleaning up temporary files...")
-        for temp_file in temp_files_to_cleanup:
-            try:
-                if os.path.isfile(temp_file):
-                    os.unlink(temp_file)
-                    print(f"Cleaned up temp file: {temp_file}")
-            except Exception as e:
-                print(f"Error cleaning up temp file {temp_file}: {e}")
-        
-        # Clean up temporary directories
-        for temp_dir in temp_dirs_to_cleanup:
-            try:
-                if os.path.isdir(temp_dir):
-                    shutil.rmtree(temp_dir)
-                    print(f"Cleaned up temp directory: {temp_dir}")
-            except Exception as e:
-                print(f"Error cleaning up temp directory {temp_dir}: {e}")
+        if not handed_off:
+            cleanup_temp_files([], temp_dirs_to_cleanup)
+
+def is_int_between(value, low, high):
+    """Whether a JSON value is a whole number from low to high"""
+    return isinstance(value, int) and not isinstance(value, bool) and low <= value <= high
+
+@app.route('/preview', methods=['POST'])
+def preview_endpoint():
+    """Composite one still per storyboard from a /render payload, as a contact sheet or individual images.
+
+    Optional fields: layout ('sheet' or 'frames'), format (png, webp or jpeg), width of each still
+    (default PREVIEW_SHEET_WIDTH on a sheet, full size otherwise, at most the profile's width) and
+    columns of the sheet (up to PREVIEW_MAX_COLUMNS).
+    Audio files and BGM are ignored.
+    """
+    try:
+        data = request.json
+        if not data or 'scenes' not in data:
+            return jsonify({'error': 'Missing scenes parameter'}), 400
+        
+        engine = data.get('engine', DEFAULT_RENDER_ENGINE)
+        profile = data.get('profile', DEFAULT_RENDER_PROFILE)
+        layout = data.get('layout', 'sheet')
+        image_format = data.get('format', 'png')
+        if engine not in RENDER_ENGINES:
+            return jsonify({'error': f"Unknown engine '{engine}', expected one of {list(RENDER_ENGINES)}"}), 400
+        if profile not in RENDER_PROFILES:
+            return jsonify({'error': f"Unknown profile '{profile}', expected one of {list(RENDER_PROFILES)}"}), 400
+        if layout not in ('sheet', 'frames'):
+            return jsonify({'error': f"Unknown layout '{layout}', expected 'sheet' or 'frames'"}), 400
+        if image_format not in IMAGE_FORMATS:
+            return jsonify({'error': f"Unknown format '{image_format}', expected one of {list(IMAGE_FORMATS)}"}), 400
+        width = data.get('width', PREVIEW_SHEET_WIDTH if layout == 'sheet' else None)
+        columns = data.get('columns', SHEET_COLUMNS)
+        max_width = RENDER_PROFILES[profile].width
+        if width is not None and not is_int_between(width, 1, max_width):
+            return jsonify({'error': f"width must be a whole number from 1 to {max_width}"}), 400
+        if not is_int_between(columns, 1, PREVIEW_MAX_COLUMNS):
+            return jsonify({'error': f"columns must be a whole number from 1 to {PREVIEW_MAX_COLUMNS}"}), 400
+        
+        with ingest_seconds.time():
+            processed_scenes = ingest_scene_images(data['scenes'], RENDER_PROFILES[profile])
+        stills = render_storyboard_stills({'scenes': processed_scenes}, RENDER_PROFILES[profile], engine)
+        if not stills:
+            return jsonify({'error': 'No storyboards to preview'}), 400
+        
+        if layout == 'sheet':
+            sheet = contact_sheet([frame for _, frame in stills], width, columns=columns)
+            body, mimetype = encode_image(sheet, image_format)
+            response = app.response_class(body, mimetype=mimetype)
+            response.headers['X-Storyboard-Count'] = str(len(stills))
+            return response
+        
+        frames = []
+        for index, (plan, frame) in enumerate(stills):
+            body, mimetype = encode_image(thumbnail(frame, width), image_format)
+            storyboard = plan['storyboard']
+            frames.append({
+                'index': index,
+                'character': storyboard.get('character', ''),
+                'line': storyboard.get('line', ''),
+                'camera_movement': plan['camera_movement'],
+                'camera_target_position': plan['camera_target_position'],
+                'image': f"data:{mimetype};base64,{base64.b64encode(body).decode('ascii')}",
+            })
+        return jsonify({'profile': profile, 'frames': frames})
+    except Exception as e:
+        print(f"Error in preview endpoint: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+def cleanup_temp_files(temp_files, temp_dirs):
+    """Remove a render's temporary input files and directories"""
+    # Clean up temporary files
+    print("Cleaning up temporary files...")
+    for temp_file in temp_files:
+        try:
+            if os.path.isfile(temp_file):
+                os.unlink(temp_file)
+                print(f"Cleaned up temp file: {temp_file}")
+        except Exception as e:
+            print(f"Error cleaning up temp file {temp_file}: {e}")
+    
+    # Clean up temporary directories
+    for temp_dir in temp_dirs:
+        try:
+            if os.path.isdir(temp_dir):
+                shutil.rmtree(temp_dir)
+                print(f"Cleaned up temp directory: {temp_dir}")
+        except Exception as e:
+            print(f"Error cleaning up temp directory {temp_dir}: {e}")
+
+@app.route('/render/jobs/<job_id>', methods=['GET'])
+def render_job_status(job_id):
+    """Status and progress of a render job"""
+    job = render_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Render job not found'}), 404
+    return jsonify(job.to_dict(render_queue.schedule()))
+
+@app.route('/render/jobs/<job_id>', methods=['DELETE'])
+def cancel_render_job(job_id):
+    """Cancel a queued or running render job"""
+    job = render_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Render job not found'}), 404
+    return jsonify(job.to_dict(render_queue.schedule()))
+
+@app.route('/render/jobs/<job_id>/result', methods=['GET'])
+def render_job_result(job_id):
+    """Download the video of a finished render job"""
+    job = render_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Render job not found'}), 404
+    if job.status != 'succeeded':
+        return jsonify({'error': f'Render job is {job.status}', 'status': job.status}), 409
+    return serve_video(os.path.basename(job.result['video_file']))
+
+@app.route('/render/batches/<batch_id>', methods=['GET'])
+def render_batch_status(batch_id):
+    """Combined status and progress of a render batch, with every episode's job"""
+    batch = render_queue.get_batch(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Render batch not found'}), 404
+    return jsonify(batch.to_dict(render_queue.schedule()))
+
+@app.route('/render/batches/<batch_id>', methods=['DELETE'])
+def cancel_render_batch(batch_id):
+    """Cancel every episode of a render batch that has not finished"""
+    batch = render_queue.cancel_batch(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Render batch not found'}), 404
+    return jsonify(batch.to_dict(render_queue.schedule()))
+
+# Content types of the files renders leave in the outputs directory
+OUTPUT_MIMETYPES = {
+    '.mp4': 'video/mp4',
+    PSTATS_SUFFIX: 'application/octet-stream',
+    COLLAPSED_SUFFIX: 'text/plain',
+}
 
 @app.route('/outputs/<filename>')
 def serve_video(filename):
-    """Serve generated video files"""
+    """Serve generated video files, and render profiles, with byte ranges and ETag/Last-Modified revalidation"""
     try:
-        video_path = os.path.join("/app/src/outputs", filename)
-        if os.path.exists(video_path):
-            return send_file(video_path, mimetype='video/mp4')
+        video_path = safe_join(OUTPUT_DIR, filename)
+        if video_path and os.path.isfile(video_path):
+            output_retention.touch(video_path)
+            # conditional answers Range and If-None-Match/If-Modified-Since requests; the body goes
+            # out through the server's wsgi.file_wrapper (sendfile) or as X-Sendfile when enabled
+            return send_file(
+                video_path, mimetype=OUTPUT_MIMETYPES.get(os.path.splitext(filename)[1], 'video/mp4'),
+                conditional=True, etag=True, max_age=OUTPUTS_CACHE_MAX_AGE
+            )
         else:
             return jsonify({'error': 'Video file not found'}), 404
     except Exception as e:
         return jsonify({'error': f'Error serving video: {str(e)}'}), 500
 
+# Content types of the files in a live HLS stream directory
+STREAM_MIMETYPES = {'.m3u8': 'application/vnd.apple.mpegurl', '.ts': 'video/mp2t'}
+
+@app.route('/streams/<stream_name>/<filename>')
+def serve_stream(stream_name, filename):
+    """Serve the live playlist and segments of a streaming render"""
+    mimetype = STREAM_MIMETYPES.get(os.path.splitext(filename)[1])
+    stream_path = safe_join(OUTPUT_DIR, stream_name, filename)
+    if not mimetype or not stream_path or not os.path.isfile(stream_path):
+        return jsonify({'error': 'Stream file not found'}), 404
+    
+    output_retention.touch(stream_path)
+    # The playlist grows while the render runs, so players must always revalidate it
+    max_age = 0 if mimetype == STREAM_MIMETYPES['.m3u8'] else OUTPUTS_CACHE_MAX_AGE
+    return send_file(stream_path, mimetype=mimetype, conditional=True, etag=True, max_age=max_age)
+
+def start_services():
+    """Start the render queue's workers and the output and payload image retention threads.
+
+    Called once by the process that serves requests, not on import, so scripts that import this
+    module (benchmark.py) and segment workers don't start threads of their own.
+    """
+    render_queue.start()
+    output_retention.start()
+    if payload_store.enabled:
+        payload_retention.start()
+
 if __name__ == '__main__':
+    # The debug reloader's first process only watches for changes; the child it starts serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_services()
     app.run(host='0.0.0.0', port=5000, debug=True)  # Make sure port is 5000
\ No newline at end of file
@@ -0,0 +1,234 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from frame_store import frame_store, payload_store
+
+# Total size of decoded pixel data kept in memory (default 512 MB)
+ASSET_CACHE_MAX_BYTES = int(os.environ.get('ASSET_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# How many (path, mtime, size) -> content hash entries to remember
+DIGEST_MEMO_SIZE = 1024
+
+
+class AssetCache:
+    """LRU cache of decoded, pre-resized RGBA arrays bounded by a byte budget"""
+
+    def __init__(self, max_bytes=ASSET_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def file_digest(self, path):
+        """Return the content hash of a file, re-hashing only when it changed on disk"""
+        stat = os.stat(path)
+        memo_key = (path, stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            digest = self._digests.get(memo_key)
+            if digest is not None:
+                self._digests.move_to_end(memo_key)
+                return digest
+
+        hasher = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+
+        with self._lock:
+            self._digests[memo_key] = digest
+            while len(self._digests) > DIGEST_MEMO_SIZE:
+                self._digests.popitem(last=False)
+        return digest
+
+    def get(self, key):
+        """Return the cached array for key, or None on a miss"""
+        with self._lock:
+            array = self._entries.get(key)
+            if array is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return array
+            self.misses += 1
+            return None
+
+    def get_or_load(self, key, loader):
+        """Return the cached array for key, calling loader() on a miss"""
+        array = self.get(key)
+        if array is not None:
+            return array
+        # Decode outside the lock so other renders are not blocked
+        return self.put(key, loader())
+
+    def put(self, key, array):
+        """Cache array under key, unless another thread got there first, and return the cached array"""
+        array.flags.writeable = False
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = array
+                self.current_bytes += array.nbytes
+            array = self._entries[key]
+            self._entries.move_to_end(key)
+            self._evict()
+        return array
+
+    def _evict(self):
+        # Always keep the most recently used entry, even if it alone exceeds the budget
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._digests.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class DecodedImage:
+    """An image that arrived decoded in a request payload, identified by the digest of its pixels.
+
+    bbox is the (x0, y0, x1, y1) box holding every pixel that is not fully transparent, or None
+    when there are none. An image kept in the payload store pickles as its store entry, so segment
+    workers map the pixels from disk on first use instead of receiving a copy with every segment.
+    """
+
+    def __init__(self, rgba, digest, bbox=None, store_entry=None):
+        self._rgba = rgba     # (h, w, 4) uint8
+        self.digest = digest
+        self.bbox = bbox if bbox is not None else alpha_bbox(rgba)
+        self.store_entry = store_entry
+
+    @property
+    def rgba(self):
+        if self._rgba is None:
+            entry = payload_store.open_entry(self.store_entry)
+            if entry is None:
+                raise FileNotFoundError(f"Payload image {self.digest[:12]} is no longer in the payload store")
+            self._rgba = entry[0]['rgba']
+        return self._rgba
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.store_entry is not None:
+            state['_rgba'] = None
+        return state
+
+    def __repr__(self):
+        return f"<DecodedImage {self.digest[:12]} {self.rgba.shape[1]}x{self.rgba.shape[0]}>"
+
+
+def alpha_bbox(rgba):
+    """(x0, y0, x1, y1) around every pixel of an RGBA array with non-zero alpha, or None if there are none"""
+    alpha = rgba[:, :, 3]
+    columns = np.flatnonzero(alpha.any(axis=0))
+    if not len(columns):
+        return None
+    rows = np.flatnonzero(alpha.any(axis=1))
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+def sprite_bbox(source, rgba):
+    """The alpha bounding box of rgba, a sprite loaded from source, possibly at another size.
+
+    A DecodedImage's box, recorded at ingest, is scaled to rgba and padded by a pixel or two for
+    resampling; other sprites are scanned.
+    """
+    if not isinstance(source, DecodedImage):
+        return alpha_bbox(rgba)
+    if source.bbox is None:
+        return None
+    height, width = rgba.shape[:2]
+    if (width, height) == (source.rgba.shape[1], source.rgba.shape[0]):
+        return source.bbox
+    scale_x, scale_y = width / source.rgba.shape[1], height / source.rgba.shape[0]
+    x0, y0, x1, y1 = source.bbox
+    return (
+        max(0, int(x0 * scale_x) - 2), max(0, int(y0 * scale_y) - 2),
+        min(width, int(np.ceil(x1 * scale_x)) + 2), min(height, int(np.ceil(y1 * scale_y)) + 2),
+    )
+
+
+def resize_rgba(img, size=None, width=None):
+    """Convert a PIL image to an RGBA uint8 array, resized to size=(w, h) or to width"""
+    img = img.convert('RGBA')
+    if size is None and width is not None:
+        size = (width, img.height * width / img.width)
+    if size is not None:
+        size = tuple(map(int, size))
+        if size != img.size:
+            img = img.resize(size, Image.Resampling.LANCZOS)
+    return np.array(img)
+
+
+def decode_rgba(path, size=None, width=None):
+    """Decode an image file to an RGBA uint8 array, resized to size=(w, h) or to width"""
+    with Image.open(path) as img:
+        return resize_rgba(img, size=size, width=width)
+
+
+def image_source_exists(source):
+    """True for a decoded payload image or a path to an existing file"""
+    if isinstance(source, DecodedImage):
+        return True
+    return bool(source) and os.path.exists(source)
+
+
+# Shared by every storyboard, scene and /render request in this process
+asset_cache = AssetCache()
+
+
+def source_digest(source):
+    """Content digest of a DecodedImage or an existing file, or None when there is nothing to load"""
+    if isinstance(source, DecodedImage):
+        return source.digest
+    if not source or not os.path.exists(source):
+        return None
+    return asset_cache.file_digest(source)
+
+
+def load_image_rgba(source, size=None, width=None):
+    """Load an image file or DecodedImage as a read-only RGBA array through the shared asset cache.
+
+    Image files are decoded through the frame store, so every process maps the same pixels.
+    """
+    if isinstance(source, DecodedImage):
+        image_height, image_width = source.rgba.shape[:2]
+        if (size is None or tuple(map(int, size)) == (image_width, image_height)) and width in (None, image_width):
+            # Normalized at ingest to exactly this size, so there is nothing to decode or resize
+            return source.rgba
+        key = (source.digest, size, width)
+        return asset_cache.get_or_load(
+            key, lambda: resize_rgba(Image.fromarray(source.rgba), size=size, width=width)
+        )
+    digest = asset_cache.file_digest(source)
+    key = (digest, size, width)
+    return asset_cache.get_or_load(key, lambda: load_stored_rgba(source, digest, size=size, width=width))
+
+
+def load_stored_rgba(source, digest, size=None, width=None):
+    """Decode an image file at a size once into the frame store and map it from there"""
+    arrays, _ = frame_store.get_or_build(
+        source, f"rgba-{size}-{width}", digest,
+        lambda: ({'rgba': decode_rgba(source, size=size, width=width)}, {})
+    )
+    return arrays['rgba']
@@ -0,0 +1,249 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+from moviepy.config import FFMPEG_BINARY
+
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+
+# BGM ducking: the bed drops to BGM_DUCK_GAIN of its volume while someone is speaking,
+# ramping over BGM_DUCK_ATTACK seconds and staying down BGM_DUCK_RELEASE seconds after speech
+BGM_DUCK_GAIN = float(os.environ.get('BGM_DUCK_GAIN', 0.35))
+BGM_DUCK_ATTACK = 0.15
+BGM_DUCK_RELEASE = 0.4
+BGM_FADE_IN = 0.5
+BGM_FADE_OUT = 1.5
+# Dialogue louder than this RMS (about -40 dBFS) counts as speech
+SPEECH_THRESHOLD = 0.01
+# Analysis window for the speech detector
+ENVELOPE_HOP = 0.01
+# The timeline is analysed and mixed this many seconds at a time
+MIX_CHUNK_SECONDS = 10.0
+# Full scale of the timeline's 16-bit samples
+PCM16_SCALE = 32767
+# An input's header in ffmpeg's log: its index, then its duration, empty when it is N/A
+DURATION_PATTERN = re.compile(r'^Input #(\d+),.*?^  Duration: (?:(\d+:\d+:[\d.]+)|N/A)', re.MULTILINE | re.DOTALL)
+
+
+def decode_audio_files(paths, sample_rate=AUDIO_SAMPLE_RATE):
+    """Decode every file to float32 (n, channels) PCM with a single ffmpeg process.
+
+    Returns one read-only array per path, or None for files that could not be decoded. The arrays
+    map the decoded files rather than holding them in memory. A path listed more than once, such
+    as a repeated voice line, is decoded once and its array shared.
+    """
+    if not paths:
+        return []
+    unique_paths = list(dict.fromkeys(paths))
+    if len(unique_paths) < len(paths):
+        decoded = dict(zip(unique_paths, decode_audio_files(unique_paths, sample_rate)))
+        return [decoded[path] for path in paths]
+    decode_dir = tempfile.mkdtemp(prefix='pcm_')
+    try:
+        outputs = [os.path.join(decode_dir, f"{i:04d}.f32") for i in range(len(paths))]
+        command = [FFMPEG_BINARY, '-y', '-loglevel', 'error']
+        for path in paths:
+            command += ['-i', path]
+        for i, output in enumerate(outputs):
+            command += ['-map', f'{i}:a:0', '-f', 'f32le', '-ac', str(AUDIO_CHANNELS), '-ar', str(sample_rate), output]
+        result = subprocess.run(command, capture_output=True)
+
+        if result.returncode != 0:
+            # One bad input fails the whole batch; fall back to decoding files one by one
+            print(f"Batch audio decode failed, decoding files individually: {result.stderr.decode(errors='replace').strip()}")
+            return [decode_audio_file(path, output, sample_rate) for path, output in zip(paths, outputs)]
+        return [read_pcm(output) for output in outputs]
+    finally:
+        shutil.rmtree(decode_dir, ignore_errors=True)
+
+
+def decode_audio_file(path, output, sample_rate=AUDIO_SAMPLE_RATE):
+    """Decode one file to float32 PCM, or return None if ffmpeg cannot read it"""
+    result = subprocess.run([
+        FFMPEG_BINARY, '-y', '-loglevel', 'error', '-i', path,
+        '-map', '0:a:0', '-f', 'f32le', '-ac', str(AUDIO_CHANNELS), '-ar', str(sample_rate), output
+    ], capture_output=True)
+    if result.returncode != 0:
+        print(f"Error decoding audio file {path}: {result.stderr.decode(errors='replace').strip()}")
+        return None
+    return read_pcm(output)
+
+
+def probe_durations(paths):
+    """Each file's duration in seconds from its container header, without decoding it; None where unknown.
+
+    Cheap enough to size a render before it is queued. Some headers, such as MP3s without a Xing
+    frame, only give an estimate from the bitrate; decode_audio_files gives exact lengths.
+    """
+    durations = {}
+    remaining = list(dict.fromkeys(paths))
+    while remaining:
+        # ffmpeg prints each input's header as it opens it and stops at the first it cannot read,
+        # so probe again from the one after it
+        result = subprocess.run(
+            [FFMPEG_BINARY, '-hide_banner'] + [arg for path in remaining for arg in ('-i', path)], capture_output=True
+        )
+        headers = dict(DURATION_PATTERN.findall(result.stderr.decode(errors='replace')))
+        for i, path in enumerate(remaining):
+            if str(i) not in headers:
+                print(f"Error probing audio file {path}")
+                durations[path] = None
+                remaining = remaining[i + 1:]
+                break
+            durations[path] = parse_duration(headers[str(i)])
+        else:
+            remaining = []
+    return [durations[path] for path in paths]
+
+
+def parse_duration(value):
+    """Seconds in an ffmpeg 'HH:MM:SS.xx' duration, or None for an empty (N/A) one"""
+    if not value:
+        return None
+    hours, minutes, seconds = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def read_pcm(path):
+    """Map a decoded f32le file. The mapping outlives the file, so its directory can be removed at once"""
+    if os.path.getsize(path) == 0:
+        return np.zeros((0, AUDIO_CHANNELS), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode='r').reshape(-1, AUDIO_CHANNELS)
+
+
+def to_pcm16(samples):
+    """float samples in [-1, 1] as 16-bit PCM, clipped"""
+    return (np.clip(samples, -1.0, 1.0) * PCM16_SCALE).astype('<i2')
+
+
+class AudioTimeline:
+    """The whole soundtrack as one 16-bit PCM buffer: dialogue placed at known offsets plus an optional BGM bed.
+
+    The buffer is a memory map of an already unlinked temporary file, so a long soundtrack lives in
+    the page cache, not the heap, and its disk space is freed with the timeline. Everything that
+    reads or mixes the whole timeline does so MIX_CHUNK_SECONDS at a time.
+    """
+
+    def __init__(self, duration, sample_rate=AUDIO_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.samples = pcm16_buffer(int(round(duration * sample_rate)))
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    def place(self, pcm, start):
+        """Mix float pcm into the timeline starting at start seconds, cut off at the timeline's end"""
+        offset = int(round(start * self.sample_rate))
+        length = max(0, min(len(pcm), len(self.samples) - offset))
+        for chunk_offset, chunk in self._chunks(offset, offset + length):
+            source = pcm[chunk_offset - offset:chunk_offset - offset + len(chunk)]
+            chunk[:] = to_pcm16(chunk / np.float32(PCM16_SCALE) + source)
+
+    def _chunks(self, start=0, end=None):
+        """(offset, writable view) over the samples from start to end, MIX_CHUNK_SECONDS at a time"""
+        end = len(self.samples) if end is None else end
+        step = max(1, int(MIX_CHUNK_SECONDS * self.sample_rate))
+        for offset in range(start, end, step):
+            yield offset, self.samples[offset:min(offset + step, end)]
+
+    def speech_mask(self):
+        """Per-window booleans marking where the dialogue is above the speech threshold"""
+        hop = max(1, int(ENVELOPE_HOP * self.sample_rate))
+        windows = -(-len(self.samples) // hop)
+        rms = np.zeros(windows, dtype=np.float32)
+        # Chunks span whole windows, so only the last window is ever padded
+        step = hop * max(1, int(MIX_CHUNK_SECONDS / ENVELOPE_HOP))
+        for offset in range(0, len(self.samples), step):
+            chunk = self.samples[offset:offset + step]
+            mono = np.zeros(-(-len(chunk) // hop) * hop, dtype=np.float32)
+            mono[:len(chunk)] = chunk.mean(axis=1, dtype=np.float32) / PCM16_SCALE
+            rms[offset // hop:offset // hop + len(mono) // hop] = np.sqrt(np.mean(mono.reshape(-1, hop) ** 2, axis=1))
+        return rms > SPEECH_THRESHOLD, hop
+
+    def ducking_envelope(self):
+        """BGM gain in [BGM_DUCK_GAIN, 1] per speech window: lowered under speech, with smooth ramps and a release hold.
+
+        Returns the gains and the window length in samples; gain_at interpolates them per sample.
+        """
+        speech, hop = self.speech_mask()
+        if len(speech) == 0:
+            return np.ones(0, dtype=np.float32), hop
+
+        # Hold the duck after each word so the bed doesn't pump between words
+        hold = max(1, int(BGM_DUCK_RELEASE / ENVELOPE_HOP))
+        held = np.convolve(speech.astype(np.float32), np.ones(hold, dtype=np.float32))[:len(speech)] > 0
+        target = np.where(held, BGM_DUCK_GAIN, 1.0).astype(np.float32)
+
+        # Moving average turns the steps into linear ramps
+        ramp = max(1, int(BGM_DUCK_ATTACK / ENVELOPE_HOP))
+        padded = np.pad(target, (ramp // 2, ramp - 1 - ramp // 2), mode='edge')
+        return np.convolve(padded, np.ones(ramp, dtype=np.float32) / ramp, mode='valid'), hop
+
+    def mix_bgm(self, bgm, volume=0.5):
+        """Loop the BGM over the whole timeline and mix it in under the dialogue, ducked and faded"""
+        if bgm is None or len(bgm) == 0 or len(self.samples) == 0:
+            return
+        envelope, hop = self.ducking_envelope()
+        window_centers = (np.arange(len(envelope)) + 0.5) * hop
+
+        for offset, chunk in self._chunks():
+            positions = np.arange(offset, offset + len(chunk))
+            bed = np.asarray(bgm[positions % len(bgm)], dtype=np.float32)
+
+            gain = np.interp(positions, window_centers, envelope).astype(np.float32) * np.float32(volume)
+            t = positions.astype(np.float32) / self.sample_rate
+            gain *= np.clip(t / BGM_FADE_IN, 0.0, 1.0)
+            gain *= np.clip((self.duration - t) / BGM_FADE_OUT, 0.0, 1.0)
+
+            chunk[:] = to_pcm16(chunk / np.float32(PCM16_SCALE) + bed * gain[:, np.newaxis])
+
+    def section(self, start, duration):
+        """A timeline viewing duration seconds of this one from start, for muxing one segment"""
+        section = AudioTimeline(0, self.sample_rate)
+        offset = int(round(start * self.sample_rate))
+        section.samples = self.samples[offset:offset + int(round(duration * self.sample_rate))]
+        return section
+
+    def pcm16_chunks(self, seconds=1.0):
+        """The timeline as 16-bit PCM bytes, a chunk at a time"""
+        step = max(1, int(seconds * self.sample_rate))
+        for offset in range(0, len(self.samples), step):
+            yield self.samples[offset:offset + step].tobytes()
+
+
+def pcm16_buffer(frames):
+    """A zeroed, writable (frames, channels) int16 array mapped from an unlinked temporary file"""
+    if frames == 0:
+        return np.zeros((0, AUDIO_CHANNELS), dtype='<i2')
+    with tempfile.TemporaryFile(prefix='timeline_') as f:
+        f.truncate(frames * AUDIO_CHANNELS * 2)
+        # The mapping keeps the file's pages alive after it is closed
+        return np.memmap(f, dtype='<i2', mode='r+', shape=(frames, AUDIO_CHANNELS))
+
+
+def mux_audio(video_input_args, timeline, output_file, output_args=('-movflags', '+faststart')):
+    """Mux the timeline as AAC with an already encoded video input, copying the video stream"""
+    command = [
+        FFMPEG_BINARY, '-y', '-loglevel', 'error',
+        *video_input_args,
+        '-f', 's16le', '-ar', str(timeline.sample_rate), '-ac', str(AUDIO_CHANNELS), '-i', 'pipe:0',
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c:v', 'copy', '-c:a', 'aac', *output_args,
+        output_file
+    ]
+    # Fed a chunk at a time, so no second full-length copy of the soundtrack is ever held
+    with subprocess.Popen(command, stdin=subprocess.PIPE) as process:
+        try:
+            for chunk in timeline.pcm16_chunks():
+                process.stdin.write(chunk)
+            process.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg gave up early; its exit status says why
+            pass
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
@@ -0,0 +1,297 @@
+"""Reproducible render benchmark.
+
+Generates a synthetic script (backgrounds, character sprites and tone-burst dialogue audio), renders it
+with render_video directly, without going through HTTP, and prints one JSON document with wall time,
+frames per second, peak RSS and the time spent per stage for every run.
+
+    python src/benchmark.py --scenes 3 --storyboards 5 --mode parallel --output before.json
+
+The script has --scenes scenes of --storyboards storyboards each. Scene i casts 1 + i % 4 characters,
+storyboards cycle through every kind of camera move and speaker, and every third storyboard is a
+narrator line, so renders mix moving and static cameras with and without subtitles. The same
+arguments always produce the same script.
+
+Peak RSS is the process's high-water mark, so a run never reports less than the runs before it;
+compare memory across separate invocations.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import wave
+from datetime import datetime, timezone
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# The renderer logs with print(); keep stdout for the JSON result
+with contextlib.redirect_stdout(sys.stderr):
+    import app
+from audio_timeline import AUDIO_SAMPLE_RATE
+from segment_cache import SegmentCache
+from stage_timings import STAGES, recording
+
+# Camera moves as the scene parser writes them, one of each kind the renderer tells apart
+CAMERA_MOVES = ['static', 'pan to {name}', 'close up on {name}', 'wide shot', 'focus on {name}', '推近到{name}', '静止']
+CHARACTER_NAMES = ['Alex', 'Sam', '李明', '张伟']
+CHARACTER_COLORS = [(220, 80, 80), (80, 140, 220), (90, 190, 110), (230, 180, 60)]
+LINES = [
+    'This is a benchmark line of ordinary length.',
+    '短句',
+    'A noticeably longer line of dialogue that makes the subtitle rasterizer work harder than usual.',
+    '这是一个用于性能测试的中文字幕。',
+]
+# Dialogue lengths cycle through these, in seconds, times --line-seconds
+LINE_LENGTHS = (1.0, 1.5, 2.0)
+
+
+def write_background(path, index, size=(app.VIDEO_WIDTH, app.VIDEO_HEIGHT)):
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    rgb = np.stack([
+        (x * 255 // width + index * 60) % 256,
+        (y * 255 // height + index * 40) % 256,
+        np.full_like(x, 96 + index * 30 % 128),
+    ], axis=-1).astype(np.uint8)
+    Image.fromarray(rgb).save(path)
+
+
+def write_character(path, color):
+    """A transparent standing figure: head and body on an empty canvas"""
+    image = Image.new('RGBA', (400, 600), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((110, 20, 290, 220), fill=(*color, 255))
+    draw.rounded_rectangle((70, 200, 330, 600), radius=60, fill=(*color, 255))
+    image.save(path)
+
+
+def write_dialogue(path, seconds, pitch):
+    """Stereo tone bursts at syllable rate, loud enough to count as speech for BGM ducking"""
+    t = np.arange(int(seconds * AUDIO_SAMPLE_RATE)) / AUDIO_SAMPLE_RATE
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    mono = 0.3 * envelope * np.sin(2 * np.pi * pitch * t)
+    samples = (np.repeat(mono[:, np.newaxis], 2, axis=1) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(AUDIO_SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
+
+
+def build_script(asset_dir, scenes, storyboards, line_seconds=1.0, bgm_seconds=0):
+    """Write the synthetic assets into asset_dir and return (scenes_data, audio_files, bgm)"""
+    characters = []
+    for index, (name, color) in enumerate(zip(CHARACTER_NAMES, CHARACTER_COLORS)):
+        path = os.path.join(asset_dir, f'character_{index}.png')
+        write_character(path, color)
+        characters.append((name, path))
+
+    expressions = app.expression_bank.names()
+    scene_list = []
+    audio_files = []
+    for scene_idx in range(scenes):
+        background = os.path.join(asset_dir, f'background_{scene_idx}.png')
+        write_background(background, scene_idx)
+        cast = characters[:1 + scene_idx % len(characters)]
+
+        sub_scenes = []
+        speakers = 0
+        for sb_idx in range(storyboards):
+            line_idx = len(audio_files)
+            if line_idx % 3 == 2:
+                # Narrator lines keep the camera still; every other one has no text, so no subtitle
+                name, image = 'Narrator', ''
+                line = LINES[line_idx % len(LINES)] if line_idx % 2 else ''
+            else:
+                name, image = cast[speakers % len(cast)]
+                speakers += 1
+                line = LINES[line_idx % len(LINES)]
+            sub_scenes.append({
+                'camera_movement': CAMERA_MOVES[line_idx % len(CAMERA_MOVES)].format(name=name),
+                'storyboards': [{
+                    'character': name,
+                    'character_image': image,
+                    'expression': expressions[line_idx % len(expressions)] if expressions else '',
+                    'line': line,
+                }],
+            })
+
+            audio_file = os.path.join(asset_dir, f'line_{line_idx:04d}.wav')
+            write_dialogue(audio_file, LINE_LENGTHS[line_idx % len(LINE_LENGTHS)] * line_seconds, 180 + 20 * (line_idx % 5))
+            audio_files.append(audio_file)
+        scene_list.append({'background': background, 'sub_scenes': sub_scenes})
+
+    bgm = None
+    if bgm_seconds:
+        bgm_file = os.path.join(asset_dir, 'bgm.wav')
+        write_dialogue(bgm_file, bgm_seconds, 110)
+        bgm = {'file': bgm_file, 'volume': 0.5}
+    return {'scenes': scene_list}, audio_files, bgm
+
+
+def expected_frames(audio_files, profile):
+    """Frames the render will encode, from the same duration rule the renderer uses"""
+    frames = 0
+    for path in audio_files:
+        with wave.open(path, 'rb') as f:
+            duration = max(0.5, f.getnframes() / f.getframerate())
+        frames += profile.frame_count(profile.snap_duration(duration))
+    return frames
+
+
+def peak_rss():
+    """Peak resident set size in bytes of this process and of its finished child processes"""
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+
+def run_once(scenes_data, audio_files, bgm, output_file, args, frames, features):
+    with recording() as timings:
+        start = time.perf_counter()
+        stats = app.render_video(
+            scenes_data, audio_files, output_file,
+            engine=args.engine, mode=args.mode, profile=args.profile, bgm=bgm
+        )
+        wall = time.perf_counter() - start
+    rss_self, rss_children = peak_rss()
+
+    stages = timings.to_dict()
+    for stage_name in STAGES:
+        stages.setdefault(stage_name, {'seconds': 0.0, 'calls': 0})
+    return {
+        'wall_seconds': round(wall, 6),
+        'frames': frames,
+        'fps': round(frames / wall, 3) if wall else None,
+        'output_bytes': os.path.getsize(output_file),
+        'peak_rss_bytes': rss_self,
+        'peak_rss_children_bytes': rss_children,
+        # In the parallel modes stage times add up across worker processes and can exceed the wall time
+        'stages': stages,
+        'unstaged_seconds': round(max(0.0, wall - timings.total), 6),
+        # The cost model's uncalibrated estimate, to check its default weights against
+        'estimated_seconds': round(app.cost_model.raw_seconds(features), 3),
+        'render_stats': stats or {},
+    }
+
+
+@contextlib.contextmanager
+def stdout_to(stream):
+    """Send stdout to stream, both sys.stdout and file descriptor 1.
+
+    Segment workers, which the pool starts during a run, and the ffmpeg processes they spawn write
+    to the descriptor they inherit, not to this process's sys.stdout.
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(stream.fileno(), 1)
+    try:
+        with contextlib.redirect_stdout(stream):
+            yield
+    finally:
+        stream.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def summarize(runs):
+    walls = [run['wall_seconds'] for run in runs]
+    return {
+        'wall_seconds_min': min(walls),
+        'wall_seconds_median': float(np.median(walls)),
+        'fps_max': max(run['fps'] or 0 for run in runs),
+        'peak_rss_bytes': max(run['peak_rss_bytes'] for run in runs),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark render_video on a synthetic script')
+    parser.add_argument('--scenes', type=int, default=3)
+    parser.add_argument('--storyboards', type=int, default=5, help='storyboards per scene')
+    parser.add_argument('--line-seconds', type=float, default=1.0, help='scale of every dialogue line length')
+    parser.add_argument('--bgm', action='store_true', help='mix a BGM bed under the dialogue')
+    parser.add_argument('--engine', choices=app.RENDER_ENGINES, default=app.DEFAULT_RENDER_ENGINE)
+    parser.add_argument('--mode', choices=[m for m in app.RENDER_MODES if m != 'streaming'], default=app.DEFAULT_RENDER_MODE)
+    parser.add_argument('--profile', choices=list(app.RENDER_PROFILES), default=app.DEFAULT_RENDER_PROFILE)
+    parser.add_argument('--warmup', type=int, default=0, help='untimed runs before the measured ones')
+    parser.add_argument('--repeat', type=int, default=1, help='measured runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--segment-cache', action='store_true',
+                        help='let parallel runs reuse cached segments (off by default so every run encodes everything)')
+    parser.add_argument('--output', help='write the JSON result here instead of stdout')
+    parser.add_argument('--keep-video', help='copy the last rendered video here')
+    parser.add_argument('--verbose', action='store_true', help="show the renderer's log on stderr")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    if not args.segment_cache:
+        app.segment_cache = SegmentCache(max_bytes=0)
+    profile = app.RENDER_PROFILES[args.profile]
+
+    work_dir = tempfile.mkdtemp(prefix='render_benchmark_')
+    log = sys.stderr if args.verbose else open(os.devnull, 'w')
+    try:
+        scenes_data, audio_files, bgm = build_script(
+            work_dir, args.scenes, args.storyboards, args.line_seconds,
+            bgm_seconds=7.0 if args.bgm else 0
+        )
+        frames = expected_frames(audio_files, profile)
+        with contextlib.redirect_stdout(log):
+            features = app.estimate_render(scenes_data, audio_files, profile)
+        output_file = os.path.join(work_dir, 'benchmark.mp4')
+
+        runs = []
+        # Keep stdout for the result
+        with stdout_to(log):
+            for i in range(args.warmup + args.repeat):
+                run = run_once(scenes_data, audio_files, bgm, output_file, args, frames, features)
+                if i >= args.warmup:
+                    runs.append(run)
+                print(f"Benchmark run {i + 1}/{args.warmup + args.repeat}: {run['wall_seconds']:.2f}s", file=sys.stderr)
+        if args.keep_video:
+            shutil.copyfile(output_file, args.keep_video)
+
+        result = {
+            'benchmark': 'render_video',
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'host': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'render_workers': app.RENDER_WORKERS,
+            },
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'keep_video', 'verbose')},
+            'script': {
+                'scenes': args.scenes,
+                'storyboards': len(audio_files),
+                'frames': frames,
+                'duration_seconds': round(frames / profile.fps, 3),
+                'profile': profile.to_dict(),
+            },
+            'runs': runs,
+            'summary': summarize(runs) if runs else {},
+        }
+    finally:
+        if log is not sys.stderr:
+            log.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    encoded = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(encoded + '\n')
+    else:
+        print(encoded)
+
+
+if __name__ == '__main__':
+    main()
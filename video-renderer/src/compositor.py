@@ -0,0 +1,250 @@
+import numpy as np
+from PIL import Image
+from moviepy.video.VideoClip import VideoClip
+
+
+def clip_rect(x, y, width, height, canvas_width, canvas_height):
+    """Intersect a layer's bounding box with the canvas.
+
+    Returns (dst_x0, dst_y0, dst_x1, dst_y1, src_x0, src_y0), or None if nothing is visible.
+    """
+    dst_x0, dst_y0 = max(x, 0), max(y, 0)
+    dst_x1, dst_y1 = min(x + width, canvas_width), min(y + height, canvas_height)
+    if dst_x0 >= dst_x1 or dst_y0 >= dst_y1:
+        return None
+    return dst_x0, dst_y0, dst_x1, dst_y1, dst_x0 - x, dst_y0 - y
+
+
+def blit_rgba(dst, rgb, alpha, x, y):
+    """Alpha-blend rgb with an (h, w) alpha in [0, 1] onto dst in place, touching only the overlap"""
+    height, width = rgb.shape[:2]
+    rect = clip_rect(int(x), int(y), width, height, dst.shape[1], dst.shape[0])
+    if rect is None:
+        return dst
+    dst_x0, dst_y0, dst_x1, dst_y1, src_x0, src_y0 = rect
+    src_x1 = src_x0 + (dst_x1 - dst_x0)
+    src_y1 = src_y0 + (dst_y1 - dst_y0)
+
+    region = dst[dst_y0:dst_y1, dst_x0:dst_x1]
+    a = alpha[src_y0:src_y1, src_x0:src_x1, np.newaxis]
+    src = rgb[src_y0:src_y1, src_x0:src_x1]
+    region[...] = (src * a + region * (1.0 - a)).astype(np.uint8)
+    return dst
+
+
+def flatten_layers(background_rgb, sprites):
+    """Flatten the background and static (rgba, x, y) sprites into one read-only RGB frame"""
+    frame = np.array(background_rgb[:, :, :3], dtype=np.uint8, copy=True)
+    for rgba, x, y in sprites:
+        blit_rgba(frame, rgba[:, :, :3], rgba[:, :, 3] / 255.0, x, y)
+    frame.flags.writeable = False
+    return frame
+
+
+class FaceOverlay:
+    """An animated expression pinned to a position on the flattened scene"""
+
+    def __init__(self, animation, x, y):
+        self.animation = animation
+        self.x = int(x)
+        self.y = int(y)
+
+    def blit(self, frame, t):
+        index = self.animation.frame_index(t)
+        blit_rgba(frame, self.animation.frames[index], self.animation.masks[index], self.x, self.y)
+
+
+class StaticSceneLayer:
+    """Background and character bodies flattened once, with only the face regions redrawn per frame"""
+
+    def __init__(self, base_frame):
+        self.base_frame = base_frame
+        self.size = (base_frame.shape[1], base_frame.shape[0])
+
+    def make_clip(self, faces, duration, subtitle=None):
+        """Build a clip that copies the cached frame and blits faces (and an optional subtitle band) on it.
+
+        subtitle is an (rgb, alpha, x, y) tuple drawn after the faces.
+        """
+        base_frame = self.base_frame
+
+        def frame_function(t):
+            frame = base_frame.copy()
+            for face in faces:
+                face.blit(frame, t)
+            if subtitle is not None:
+                blit_rgba(frame, *subtitle)
+            return frame
+
+        return VideoClip(frame_function=frame_function, duration=duration)
+
+
+def premultiply(rgb, alpha):
+    """Return float32 premultiplied colors (rounded for truncation) and inverse alphas"""
+    alpha = np.asarray(alpha, dtype=np.float32)[..., np.newaxis]
+    return rgb * alpha + 0.5, 1.0 - alpha
+
+
+class Layer:
+    """One flat compositor layer: premultiplied RGBA frames clipped to their visible bounding box.
+
+    colors is (n, h, w, 3) and inverse_alphas is (n, h, w, 1); frame_index maps t to a frame,
+    or is None for a static layer. Opaque layers keep uint8 colors and no alpha at all.
+    """
+
+    def __init__(self, colors, inverse_alphas, x, y, canvas_size, frame_index=None, opaque=False):
+        canvas_width, canvas_height = canvas_size
+        height, width = colors.shape[1:3]
+        rect = clip_rect(int(x), int(y), width, height, canvas_width, canvas_height)
+        self.visible = rect is not None
+        self.frame_index = frame_index
+        self.opaque = opaque
+        if not self.visible:
+            return
+
+        self.x0, self.y0, self.x1, self.y1, src_x0, src_y0 = rect
+        src_x1 = src_x0 + (self.x1 - self.x0)
+        src_y1 = src_y0 + (self.y1 - self.y0)
+        self.colors = colors[:, src_y0:src_y1, src_x0:src_x1]
+        self.covers_canvas = (self.x0, self.y0, self.x1, self.y1) == (0, 0, canvas_width, canvas_height)
+        if opaque:
+            return
+        self.inverse_alphas = inverse_alphas[:, src_y0:src_y1, src_x0:src_x1]
+        # Per-layer scratch so blending never allocates
+        self.scratch = np.empty(self.colors.shape[1:], dtype=np.float32)
+
+    @classmethod
+    def from_rgb(cls, rgb, canvas_size):
+        """A fully opaque static layer, such as the background"""
+        colors = np.asarray(rgb[:, :, :3], dtype=np.uint8)[np.newaxis]
+        return cls(colors, None, 0, 0, canvas_size, opaque=True)
+
+    @classmethod
+    def from_rgba(cls, rgba, x, y, canvas_size):
+        """A static sprite with an 8-bit alpha channel"""
+        colors, inverse_alphas = premultiply(rgba[:, :, :3], rgba[:, :, 3] / 255.0)
+        return cls(colors[np.newaxis], inverse_alphas[np.newaxis], x, y, canvas_size)
+
+    @classmethod
+    def from_rgb_alpha(cls, rgb, alpha, x, y, canvas_size):
+        """A static sprite with a separate float alpha mask, such as a rasterized subtitle"""
+        colors, inverse_alphas = premultiply(rgb, alpha)
+        return cls(colors[np.newaxis], inverse_alphas[np.newaxis], x, y, canvas_size)
+
+    @classmethod
+    def from_animation(cls, animation, x, y, canvas_size):
+        """An expression animation whose frame is looked up by time"""
+        colors, inverse_alphas = animation.premultiplied()
+        return cls(colors, inverse_alphas, x, y, canvas_size, frame_index=animation.frame_index)
+
+    def blit(self, out, t):
+        """Blend this layer's frame at time t over out, in place and within the bounding box only"""
+        index = self.frame_index(t) if self.frame_index else 0
+        region = out[self.y0:self.y1, self.x0:self.x1]
+        if self.opaque:
+            np.copyto(region, self.colors[index])
+            return
+        np.multiply(region, self.inverse_alphas[index], out=self.scratch)
+        np.add(self.scratch, self.colors[index], out=self.scratch)
+        np.copyto(region, self.scratch, casting='unsafe')
+
+
+class FrameCompositor:
+    """Composite a flat list of layers into one preallocated output buffer per frame"""
+
+    def __init__(self, layers, canvas_size):
+        self.canvas_size = canvas_size
+        self.layers = [layer for layer in layers if layer.visible]
+        self.out = np.zeros((canvas_size[1], canvas_size[0], 3), dtype=np.uint8)
+
+        # Start from the topmost full-canvas opaque layer; nothing below it can show
+        self.start = 0
+        for index, layer in enumerate(self.layers):
+            if layer.opaque and layer.covers_canvas:
+                self.start = index
+
+    def render(self, t):
+        if not self.layers or not (self.layers[self.start].opaque and self.layers[self.start].covers_canvas):
+            self.out.fill(0)
+        for layer in self.layers[self.start:]:
+            layer.blit(self.out, t)
+        return self.out
+
+    def flatten(self):
+        """Render the (static) layers once and return them as a single opaque layer"""
+        return Layer.from_rgb(self.render(0).copy(), self.canvas_size)
+
+    def make_clip(self, duration):
+        return VideoClip(frame_function=self.render, duration=duration)
+
+
+class BitmapOverlay:
+    """A static RGB + alpha bitmap, such as a subtitle, blitted on top of finished frames"""
+
+    def __init__(self, rgb, alpha, x, y):
+        self.rgb = rgb
+        self.alpha = alpha
+        self.x = int(x)
+        self.y = int(y)
+
+    def blit(self, frame, t):
+        blit_rgba(frame, self.rgb, self.alpha, self.x, self.y)
+
+
+class CameraCrop:
+    """A camera move expressed as a crop window over the composited scene, one window per output frame.
+
+    zoom(t) and offset(t) describe the scene scaled by zoom and placed at offset on the output
+    canvas; the equivalent source window is precomputed so only it gets resampled per frame.
+    """
+
+    def __init__(self, zoom, offset, duration, fps, size, resample=Image.Resampling.BILINEAR):
+        self.fps = fps
+        self.size = size
+        self.resample = resample
+        frame_count = int(np.ceil(duration * fps)) + 1
+        self.windows = [self._window(zoom(i / fps), offset(i / fps)) for i in range(frame_count)]
+
+    def _window(self, zoom, offset):
+        width, height = self.size
+        offset_x, offset_y = offset
+        # Source window that lands on the output canvas
+        box = (-offset_x / zoom, -offset_y / zoom, (width - offset_x) / zoom, (height - offset_y) / zoom)
+        # Parts of the window outside the scene stay black, as with the scaled-and-placed frame
+        clamped = (max(box[0], 0), max(box[1], 0), min(box[2], width), min(box[3], height))
+        if clamped == box:
+            return box, None
+        dst = (
+            int(round(offset_x + clamped[0] * zoom)), int(round(offset_y + clamped[1] * zoom)),
+            int(round(offset_x + clamped[2] * zoom)), int(round(offset_y + clamped[3] * zoom)),
+        )
+        return clamped, dst
+
+    def window(self, t):
+        """The (source box, destination box or None) crop window of the frame at t"""
+        return self.windows[min(int(round(t * self.fps)), len(self.windows) - 1)]
+
+    def apply(self, frame, t):
+        """Resample this frame's crop window to the output size"""
+        box, dst = self.window(t)
+        image = Image.fromarray(frame)
+        if dst is None:
+            return np.array(image.resize(self.size, self.resample, box=box))
+
+        out = np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+        dst_x0, dst_y0 = max(dst[0], 0), max(dst[1], 0)
+        dst_x1, dst_y1 = min(dst[2], self.size[0]), min(dst[3], self.size[1])
+        if dst_x0 < dst_x1 and dst_y0 < dst_y1:
+            out[dst_y0:dst_y1, dst_x0:dst_x1] = image.resize((dst_x1 - dst_x0, dst_y1 - dst_y0), self.resample, box=box)
+        return out
+
+
+def with_overlays(clip, overlays):
+    """Blit overlays onto every frame of a clip whose frames are fresh arrays"""
+    def filter(get_frame, t):
+        frame = get_frame(t)
+        for overlay in overlays:
+            overlay.blit(frame, t)
+        return frame
+
+    return clip.transform(filter)
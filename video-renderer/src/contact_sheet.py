@@ -0,0 +1,49 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+# Still image formats a preview can be returned in: Pillow format name, MIME type and save options.
+# PNG is saved with light compression, which is several times faster and only a little larger
+IMAGE_FORMATS = {
+    'png': ('PNG', 'image/png', {'compress_level': 1}),
+    'webp': ('WEBP', 'image/webp', {'quality': 85}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 85}),
+}
+
+SHEET_COLUMNS = 4
+SHEET_GAP = 8
+SHEET_BACKGROUND = (24, 24, 24)
+
+
+def thumbnail(rgb, width):
+    """An RGB frame scaled to width, keeping its aspect ratio"""
+    height, frame_width = rgb.shape[:2]
+    if width is None or width == frame_width:
+        return rgb
+    size = (max(1, int(width)), max(1, int(round(height * width / frame_width))))
+    return np.array(Image.fromarray(rgb).resize(size, Image.Resampling.BILINEAR))
+
+
+def contact_sheet(stills, width, columns=SHEET_COLUMNS, gap=SHEET_GAP, background=SHEET_BACKGROUND):
+    """Lay out equally sized RGB stills row by row, each scaled to width, on one sheet"""
+    cells = [thumbnail(still, width) for still in stills]
+    cell_height, cell_width = cells[0].shape[:2]
+    columns = max(1, min(columns, len(cells)))
+    rows = -(-len(cells) // columns)
+    sheet = np.empty((gap + rows * (cell_height + gap), gap + columns * (cell_width + gap), 3), dtype=np.uint8)
+    sheet[:] = background
+    for index, cell in enumerate(cells):
+        row, column = divmod(index, columns)
+        y = gap + row * (cell_height + gap)
+        x = gap + column * (cell_width + gap)
+        sheet[y:y + cell_height, x:x + cell_width] = cell
+    return sheet
+
+
+def encode_image(rgb, image_format):
+    """Encode an RGB array as one of IMAGE_FORMATS; returns (bytes, mimetype)"""
+    pillow_format, mimetype, options = IMAGE_FORMATS[image_format]
+    buffer = io.BytesIO()
+    Image.fromarray(rgb).save(buffer, format=pillow_format, **options)
+    return buffer.getvalue(), mimetype
@@ -0,0 +1,83 @@
+import os
+import threading
+from collections import deque
+
+# Seconds per unit of work at 1280x720, before calibration; measured with benchmark.py in serial mode
+DEFAULT_COST_WEIGHTS = {
+    'frame': 0.03,              # compositing and encoding one frame
+    'character_frame': 0.003,   # each character's face blitted on a frame
+    'moving_frame': 0.02,       # resampling a frame for a camera move
+    'storyboard': 0.1,          # building one storyboard's clip and subtitle
+    'render': 1.0,              # audio decode, mux and setup, once per render
+}
+# Frame costs scale with the pixel count relative to this
+REFERENCE_PIXELS = 1280 * 720
+
+# Finished renders of each kind the calibration learns from
+COST_CALIBRATION_RENDERS = int(os.environ.get('COST_CALIBRATION_RENDERS', 50))
+
+
+def render_features(storyboards, profile):
+    """The cost model's inputs for a planned render.
+
+    storyboards is a list of (duration in seconds, characters on screen, camera moves) per storyboard.
+    """
+    features = {'frame': 0, 'character_frame': 0, 'moving_frame': 0, 'storyboard': len(storyboards), 'render': 1}
+    for duration, characters, moving in storyboards:
+        frames = profile.frame_count(duration)
+        features['frame'] += frames
+        features['character_frame'] += frames * characters
+        if moving:
+            features['moving_frame'] += frames
+    features['pixel_scale'] = profile.width * profile.height / REFERENCE_PIXELS
+    return features
+
+
+class RenderCostModel:
+    """Predicts a render's wall time from its features, calibrated against renders that finished.
+
+    A weighted sum of the features gives a raw cost; each kind of render (the app uses mode and
+    profile) then has its own scale, the ratio of measured to raw seconds over its recent renders,
+    so the estimate tracks the machine and the render settings without refitting every weight.
+    """
+
+    def __init__(self, weights=DEFAULT_COST_WEIGHTS, history=COST_CALIBRATION_RENDERS):
+        self.weights = dict(weights)
+        self._history = {}
+        self._history_size = history
+        self._lock = threading.Lock()
+
+    def raw_seconds(self, features):
+        frame_costs = sum(self.weights[name] * features[name] for name in ('frame', 'character_frame', 'moving_frame'))
+        return (
+            frame_costs * features['pixel_scale']
+            + self.weights['storyboard'] * features['storyboard']
+            + self.weights['render'] * features['render']
+        )
+
+    def scale(self, kind):
+        with self._lock:
+            history = self._history.get(kind)
+            if not history:
+                return 1.0
+            raw = sum(raw for raw, _ in history)
+            return sum(seconds for _, seconds in history) / raw if raw else 1.0
+
+    def estimate(self, features, kind):
+        """Estimated wall seconds of a render of this kind with these features"""
+        return self.raw_seconds(features) * self.scale(kind)
+
+    def observe(self, features, kind, seconds):
+        """Calibrate with the measured wall time of a finished render"""
+        raw = self.raw_seconds(features)
+        if raw <= 0:
+            return
+        with self._lock:
+            history = self._history.setdefault(kind, deque(maxlen=self._history_size))
+            history.append((raw, seconds))
+
+    def stats(self):
+        with self._lock:
+            kinds = list(self._history)
+            samples = {kind: len(self._history[kind]) for kind in kinds}
+        return {kind: {'samples': samples[kind], 'scale': round(self.scale(kind), 4)} for kind in kinds}
@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+from PIL import Image, ImageSequence
+from moviepy.video.VideoClip import VideoClip
+
+from asset_cache import asset_cache
+
+# Browsers treat GIF frame delays this short as "unspecified" and play them at 100ms
+MIN_FRAME_DURATION = 0.02
+DEFAULT_FRAME_DURATION = 0.1
+
+
+class ExpressionAnimation:
+    """Frames, alpha masks and timing of one expression GIF at one face width"""
+
+    def __init__(self, frames, masks, durations, premultiplied=None):
+        self.frames = frames          # (n, h, w, 3) uint8
+        self.masks = masks            # (n, h, w) float32 in [0, 1]
+        self.durations = durations    # (n,) seconds
+        self.frame_ends = np.cumsum(durations)
+        self.total_duration = float(self.frame_ends[-1])
+        self.size = (frames.shape[2], frames.shape[1])
+        self._premultiplied = premultiplied
+
+    def frame_index(self, t):
+        """Index of the frame shown at time t, looping the animation forever"""
+        t = t % self.total_duration
+        index = int(np.searchsorted(self.frame_ends, t, side='right'))
+        return min(index, len(self.frame_ends) - 1)
+
+    def frame_at(self, t):
+        return self.frames[self.frame_index(t)]
+
+    def mask_at(self, t):
+        return self.masks[self.frame_index(t)]
+
+    def premultiplied(self):
+        """Premultiplied float32 colors and inverse alphas for the NumPy compositor, computed once"""
+        if self._premultiplied is None:
+            alphas = self.masks[..., np.newaxis]
+            colors = self.frames * alphas + 0.5
+            self._premultiplied = (colors, 1.0 - alphas)
+        return self._premultiplied
+
+    def make_clip(self, duration):
+        """Build a looping clip with mask that reads straight from the preloaded frames"""
+        mask = VideoClip(frame_function=self.mask_at, is_mask=True, duration=duration)
+        return VideoClip(frame_function=self.frame_at, duration=duration).with_mask(mask)
+
+
+def decode_gif(path):
+    """Decode every frame of a GIF to RGBA PIL images plus per-frame durations in seconds"""
+    images = []
+    durations = []
+    with Image.open(path) as gif:
+        for frame in ImageSequence.Iterator(gif):
+            images.append(frame.convert('RGBA'))
+            delay = frame.info.get('duration', 0) / 1000.0
+            durations.append(delay if delay >= MIN_FRAME_DURATION else DEFAULT_FRAME_DURATION)
+    return images, np.array(durations, dtype=np.float64)
+
+
+def gif_decoder(path):
+    """A function returning decode_gif(path), decoding on its first call only"""
+    decoded = []
+
+    def decode():
+        if not decoded:
+            decoded.append(decode_gif(path))
+        return decoded[0]
+    return decode
+
+
+def scale_frames(images, durations, width):
+    """Resize decoded frames to width and split them into RGB frames and float32 masks"""
+    height = int(images[0].height * width / images[0].width)
+    rgba = np.stack([
+        np.array(image.resize((width, height), Image.Resampling.LANCZOS))
+        for image in images
+    ])
+    frames = np.ascontiguousarray(rgba[:, :, :, :3])
+    masks = rgba[:, :, :, 3].astype(np.float32) / np.float32(255)
+    frames.flags.writeable = False
+    masks.flags.writeable = False
+    return ExpressionAnimation(frames, masks, durations)
+
+
+class ExpressionBank:
+    """Registry of every expression GIF, decoded once and pre-scaled for each face width.
+
+    With a frame store, the scaled frames, masks and premultiplied colors are kept there and mapped,
+    so worker processes share them and a restart only decodes GIFs that changed.
+    """
+
+    def __init__(self, directory, face_widths, store=None):
+        self.directory = directory
+        self.face_widths = tuple(face_widths)
+        self.store = store
+        self._animations = {}
+        self._digests = {}
+
+    def _load_animation(self, path, width, decoded):
+        """The animation of the GIF at path at width; decoded() returns its decoded frames and durations"""
+        if self.store is None:
+            return scale_frames(*decoded(), width)
+
+        def build():
+            animation = scale_frames(*decoded(), width)
+            colors, inverse_alphas = animation.premultiplied()
+            arrays = {
+                'frames': animation.frames, 'masks': animation.masks,
+                'colors': colors, 'inverse_alphas': inverse_alphas,
+            }
+            return arrays, {'durations': animation.durations.tolist()}
+
+        arrays, meta = self.store.get_or_build(path, f"expression-{width}", asset_cache.file_digest(path), build)
+        return ExpressionAnimation(
+            arrays['frames'], arrays['masks'], np.array(meta['durations'], dtype=np.float64),
+            premultiplied=(arrays['colors'], arrays['inverse_alphas'])
+        )
+
+    def load(self):
+        """Decode all GIFs in the expressions directory"""
+        if not os.path.isdir(self.directory):
+            print(f"Expressions directory not found: {self.directory}")
+            return self
+
+        for filename in sorted(os.listdir(self.directory)):
+            name, ext = os.path.splitext(filename)
+            if ext.lower() != '.gif':
+                continue
+            try:
+                path = os.path.join(self.directory, filename)
+                digest = asset_cache.file_digest(path)
+                decoded = gif_decoder(path)
+                self._animations[name] = {
+                    width: self._load_animation(path, width, decoded)
+                    for width in self.face_widths
+                }
+                self._digests[name] = digest
+                animation = next(iter(self._animations[name].values()))
+                print(f"Loaded expression {name}: {len(animation.durations)} frames, {animation.total_duration:.2f}s")
+            except Exception as e:
+                print(f"Error loading expression {filename}: {e}")
+        return self
+
+    def names(self):
+        return list(self._animations.keys())
+
+    def has(self, name):
+        return name in self._animations
+
+    def digest(self, name):
+        """Content digest of the GIF that name was loaded from"""
+        return self._digests[name]
+
+    def get(self, name, face_width):
+        """Return the ExpressionAnimation for name at face_width, scaling on demand for new widths"""
+        animations = self._animations[name]
+        if face_width not in animations:
+            path = os.path.join(self.directory, f"{name}.gif")
+            animations[face_width] = self._load_animation(path, face_width, gif_decoder(path))
+        return animations[face_width]
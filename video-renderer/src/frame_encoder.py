@@ -0,0 +1,226 @@
+import os
+import queue
+import struct
+import subprocess
+import threading
+import time
+from fractions import Fraction
+
+from moviepy.config import FFMPEG_BINARY
+
+# Frames the compositor may run ahead of the encoder; each is width x height x 3 bytes (2.6 MB at 720p)
+ENCODER_QUEUE_FRAMES = int(os.environ.get('ENCODER_QUEUE_FRAMES', 8))
+
+
+# A zero-length frame chunk: ffmpeg's AVI demuxer advances the timestamp without a new picture
+EMPTY_FRAME_CHUNK = b'00db' + struct.pack('<I', 0)
+
+
+class EncoderError(Exception):
+    """Raised when ffmpeg fails or exits while frames are still being written"""
+
+
+class FrameEncoder:
+    """A long-lived x264 process fed raw RGB frames through a bounded queue by its own writer thread.
+
+    write_frame() only queues the frame, so the caller composites the next frames while earlier
+    ones are piped to ffmpeg. Frames are never dropped; instead each side counts the time it spent
+    waiting on the other, which shows whether compositing or encoding is the bottleneck.
+
+    Frames go down the pipe as an uncompressed AVI stream rather than bare rawvideo, so a held
+    frame (repeat_frame) is an empty chunk: it takes no queue slot and no copy, and ffmpeg's fps
+    filter duplicates the previous picture back into the constant-rate output.
+    """
+
+    def __init__(self, output_file, profile, queue_frames=ENCODER_QUEUE_FRAMES):
+        self.output_file = output_file
+        self.profile = profile
+        self.frames = 0
+        self.frames_repeated = 0
+        self.max_queued = 0
+        # write_frame() waiting for queue space: the encoder is the bottleneck
+        self.compositor_blocked = 0.0
+        # The writer thread waiting for a frame: compositing is the bottleneck
+        self.encoder_starved = 0.0
+        # Writing into ffmpeg's stdin, which blocks while x264 catches up
+        self.pipe_write = 0.0
+        # close() waiting for x264 to drain its lookahead and finish the file
+        self.flush = 0.0
+        self._closed = False
+        self._queue = queue.Queue(maxsize=max(1, queue_frames))
+        self._error = None
+        self._last = None
+        # Repeats of _last not yet sent; they go out ahead of the next frame
+        self._held = 0
+        self._process = None
+        self._thread = None
+
+    def start(self):
+        rate = Fraction(self.profile.fps).limit_denominator(1001)
+        self._process = subprocess.Popen([
+            FFMPEG_BINARY, '-y', '-loglevel', 'error',
+            '-f', 'avi', '-an', '-i', '-',
+            '-vf', f'fps={rate.numerator}/{rate.denominator}',
+            '-vcodec', 'libx264', '-preset', self.profile.preset, *self.profile.ffmpeg_params(),
+            '-pix_fmt', 'yuv420p',
+            self.output_file
+        ], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self._process.stdin.write(avi_header(*self.profile.size, rate))
+        self._thread = threading.Thread(target=self._run, name='frame-encoder', daemon=True)
+        self._thread.start()
+        return self
+
+    def write_frame(self, frame):
+        """Queue an RGB frame for encoding; it is copied, so the caller may reuse its buffer"""
+        self._last = frame.tobytes()
+        self._put((self._held, self._last))
+        self._held = 0
+
+    def repeat_frame(self):
+        """Hold the previous frame for one more frame, for a picture that has not changed"""
+        self._held += 1
+        self.frames_repeated += 1
+
+    def _put(self, data):
+        start = time.perf_counter()
+        while True:
+            if self._error is not None:
+                raise EncoderError(f"Encoder for {self.output_file} failed: {self._error}")
+            try:
+                self._queue.put(data, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.compositor_blocked += time.perf_counter() - start
+        self.max_queued = max(self.max_queued, self._queue.qsize())
+
+    def _run(self):
+        while True:
+            start = time.perf_counter()
+            item = self._queue.get()
+            self.encoder_starved += time.perf_counter() - start
+            if item is None:
+                return
+            if self._error is not None:
+                # Keep draining so a blocked write_frame() wakes up and sees the error
+                continue
+            held, data = item
+            try:
+                start = time.perf_counter()
+                self._process.stdin.write(EMPTY_FRAME_CHUNK * held + b'00db' + struct.pack('<I', len(data)))
+                self._process.stdin.write(data)
+                if len(data) % 2:
+                    self._process.stdin.write(b'\0')
+                self.pipe_write += time.perf_counter() - start
+                self.frames += held + 1
+            except (BrokenPipeError, OSError) as e:
+                self._error = e
+
+    def close(self):
+        """Encode every queued frame and wait for ffmpeg to finish the file"""
+        if self._closed:
+            return
+        self._closed = True
+        start = time.perf_counter()
+        if self._held:
+            # Trailing empty chunks carry no end time, so the last held frame is sent in full
+            self._queue.put((self._held - 1, self._last))
+            self._held = 0
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = self._process.stderr.read().decode(errors='replace').strip()
+        self._process.stderr.close()
+        returncode = self._process.wait()
+        self.flush = time.perf_counter() - start
+        if returncode != 0 or self._error is not None:
+            raise EncoderError(f"ffmpeg failed encoding {self.output_file}: {stderr or self._error}")
+
+    def abort(self):
+        """Stop encoding without finishing the file"""
+        if self._closed:
+            return
+        self._closed = True
+        self._process.kill()
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        self._process.stderr.close()
+        self._process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'frames_repeated': self.frames_repeated,
+            'queue_frames': self._queue.maxsize,
+            'max_queued': self.max_queued,
+            'compositor_blocked_seconds': round(self.compositor_blocked, 6),
+            'encoder_starved_seconds': round(self.encoder_starved, 6),
+            'pipe_write_seconds': round(self.pipe_write, 6),
+            'flush_seconds': round(self.flush, 6),
+        }
+
+
+def avi_header(width, height, rate):
+    """Headers of an open-ended AVI stream of top-down RGB24 frames at rate frames per second.
+
+    The RIFF and movi sizes are left at their maximum; ffmpeg reads chunks until the pipe closes.
+    """
+    def chunk(tag, data):
+        return tag + struct.pack('<I', len(data)) + data
+
+    def chunk_list(tag, data):
+        return b'LIST' + struct.pack('<I', len(data) + 4) + tag + data
+
+    frame_bytes = width * height * 3
+    main_header = struct.pack(
+        '<10I16x', round(1e6 / rate), 0, 0, 0x10, 0, 0, 1, frame_bytes, width, height
+    )
+    stream_header = b'vids' + b'raw ' + struct.pack(
+        '<IHHIIIIIIIIhhhh', 0, 0, 0, 0, rate.denominator, rate.numerator, 0, 0, frame_bytes, 0xFFFFFFFF, 0,
+        0, 0, width, height
+    )
+    # A negative height marks rows as top to bottom, as numpy lays them out
+    stream_format = struct.pack('<IiiHH4sIiiII', 40, width, -height, 1, 24, b'raw ', frame_bytes, 0, 0, 0, 0)
+    header_list = chunk_list(b'hdrl', chunk(b'avih', main_header) + chunk_list(
+        b'strl', chunk(b'strh', stream_header) + chunk(b'strf', stream_format)
+    ))
+    return b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'AVI ' + header_list + b'LIST' + struct.pack('<I', 0xFFFFFFFF) + b'movi'
+
+
+def combine_stats(stats):
+    """Add up the stats() of several encoders, such as one per segment"""
+    combined = {
+        'frames': 0,
+        'frames_repeated': 0,
+        'queue_frames': 0,
+        'max_queued': 0,
+        'compositor_blocked_seconds': 0.0,
+        'encoder_starved_seconds': 0.0,
+        'pipe_write_seconds': 0.0,
+        'flush_seconds': 0.0,
+    }
+    for entry in stats:
+        for key, value in entry.items():
+            if key in ('queue_frames', 'max_queued'):
+                combined[key] = max(combined[key], value)
+            else:
+                combined[key] += value
+    for key in ('compositor_blocked_seconds', 'encoder_starved_seconds', 'pipe_write_seconds', 'flush_seconds'):
+        combined[key] = round(combined[key], 6)
+    return combined
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import uuid
+
+import numpy as np
+
+# Decoded expression frames and assets, kept on disk as raw arrays that every process maps
+# read-only, so renderer workers share one page-cache copy. Set to '' to keep them in memory instead
+FRAME_STORE_DIR = os.environ.get('FRAME_STORE_DIR', os.path.join(tempfile.gettempdir(), 'render_frame_store'))
+
+# Bump when what gets stored for a source changes, so old entries are not reused
+FRAME_STORE_VERSION = 2
+
+DATA_SUFFIX = '.frames'
+INDEX_SUFFIX = '.json'
+# Every array starts on a cache-line boundary
+ALIGNMENT = 64
+
+
+class FrameStore:
+    """Named arrays decoded from a source file, stored once on disk and opened with numpy.memmap.
+
+    An entry is a raw data file plus a small JSON index of each array's offset, dtype and shape and
+    any metadata, such as frame durations. Entries are named after the source, a variant (the size
+    it was decoded at) and the source's content digest, so editing a GIF or PNG makes a new entry;
+    the stale one is deleted when the new one is written. Arrays come back read-only.
+    """
+
+    def __init__(self, directory=FRAME_STORE_DIR):
+        self.directory = directory
+        self.hits = 0
+        self.builds = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _prefix(self, source, variant):
+        name = f"{FRAME_STORE_VERSION}\0{os.path.abspath(source)}\0{variant}"
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()[:20]
+
+    def entry_name(self, source, variant, digest):
+        """The name source at variant is stored under, which other processes can open_entry()"""
+        return f"{self._prefix(source, variant)}-{digest[:16]}"
+
+    def get_or_build(self, source, variant, digest, build):
+        """Return (arrays, meta) for source at variant, calling build() -> (arrays, meta) when it is not stored"""
+        if not self.enabled:
+            return build()
+        prefix = self._prefix(source, variant)
+        name = self.entry_name(source, variant, digest)
+
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is not None:
+            return entry
+
+        entry = self._open(name)
+        if entry is None:
+            arrays, meta = build()
+            try:
+                self._write(name, source, variant, arrays, meta)
+                self._prune(prefix, name)
+                entry = self._open(name)
+            except OSError as e:
+                print(f"Error writing frame store entry for {source}: {e}")
+            if entry is None:
+                # Unwritable store: serve this process from memory
+                return arrays, meta
+            self.builds += 1
+        else:
+            self.hits += 1
+
+        with self._lock:
+            entry = self._entries.setdefault(name, entry)
+        return entry
+
+    def open_entry(self, name):
+        """Return (arrays, meta) of the entry stored under name, or None when it is not on disk"""
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None and self.enabled:
+            entry = self._open(name)
+            if entry is not None:
+                with self._lock:
+                    entry = self._entries.setdefault(name, entry)
+        return entry
+
+    def touch(self, name):
+        """Mark an entry as just used, for a sweeper that evicts by age; False when it is no longer on disk"""
+        try:
+            for suffix in (DATA_SUFFIX, INDEX_SUFFIX):
+                os.utime(os.path.join(self.directory, name + suffix))
+        except OSError:
+            # Evicted: forget the mapping so the entry is written again
+            with self._lock:
+                self._entries.pop(name, None)
+            return False
+        return True
+
+    def _open(self, name):
+        index_path = os.path.join(self.directory, name + INDEX_SUFFIX)
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            data = np.memmap(os.path.join(self.directory, name + DATA_SUFFIX), dtype=np.uint8, mode='r')
+        except (OSError, ValueError):
+            return None
+        arrays = {
+            key: np.ndarray(tuple(spec['shape']), dtype=np.dtype(spec['dtype']), buffer=data, offset=spec['offset'])
+            for key, spec in index['arrays'].items()
+        }
+        return arrays, index['meta']
+
+    def _write(self, name, source, variant, arrays, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        specs = {}
+        offset = 0
+        for key, array in arrays.items():
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            specs[key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += array.nbytes
+
+        # Written under temporary names and renamed into place, data first, so concurrent
+        # builders never see a partial entry and an index always has its data
+        token = uuid.uuid4().hex
+        data_path = os.path.join(self.directory, name + DATA_SUFFIX)
+        index_path = os.path.join(self.directory, name + INDEX_SUFFIX)
+        with open(f"{data_path}.{token}.tmp", 'wb') as f:
+            for key, array in arrays.items():
+                f.seek(specs[key]['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            # A mapping cannot be empty
+            f.truncate(max(offset, 1))
+        os.replace(f"{data_path}.{token}.tmp", data_path)
+        with open(f"{index_path}.{token}.tmp", 'w') as f:
+            json.dump({'source': source, 'variant': variant, 'arrays': specs, 'meta': meta}, f)
+        os.replace(f"{index_path}.{token}.tmp", index_path)
+        print(f"Stored {source} ({variant}) in frame store: {offset} bytes")
+
+    def _prune(self, prefix, keep):
+        """Delete entries for the same source and variant built from an older version of the source"""
+        for filename in os.listdir(self.directory):
+            name, ext = os.path.splitext(filename)
+            if name.startswith(prefix + '-') and name != keep and ext in (DATA_SUFFIX, INDEX_SUFFIX):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+        with self._lock:
+            for name in [name for name in self._entries if name.startswith(prefix + '-') and name != keep]:
+                del self._entries[name]
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            'entries': len(entries),
+            'bytes': sum(array.nbytes for arrays, _ in entries for array in arrays.values()),
+            'hits': self.hits,
+            'misses': self.builds,
+        }
+
+
+# Shared by the expression bank and the asset cache; forked workers inherit the open mappings
+frame_store = FrameStore()
+
+# Images decoded from /render payloads, so segment workers map them instead of receiving pickled
+# copies. Uploads never repeat the way asset files do, so these are evicted by age and total size
+payload_store = FrameStore(FRAME_STORE_DIR and os.path.join(FRAME_STORE_DIR, 'payloads'))
+PAYLOAD_STORE_MAX_BYTES = int(os.environ.get('PAYLOAD_STORE_MAX_BYTES', 1024 * 1024 * 1024))
+PAYLOAD_STORE_MAX_AGE = int(os.environ.get('PAYLOAD_STORE_MAX_AGE', 24 * 3600))
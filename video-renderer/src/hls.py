@@ -0,0 +1,77 @@
+import math
+import os
+
+from audio_timeline import mux_audio
+
+PLAYLIST_NAME = 'index.m3u8'
+# Added to every segment's timestamps so B-frame reordering never pushes the first DTS below zero,
+# which the muxer would otherwise fix by shifting only the first segment
+TIMESTAMP_OFFSET = 1.0
+
+
+class HlsStream:
+    """A live HLS playlist of MPEG-TS segments that grows, in order, as storyboard segments finish.
+
+    Segments may finish in any order; each is published once every segment before it has been.
+    """
+
+    def __init__(self, directory, timeline, durations):
+        self.directory = directory
+        self.timeline = timeline
+        self.durations = list(durations)
+        self.starts = [sum(self.durations[:i]) for i in range(len(self.durations))]
+        # Every duration is known up front, so the target duration never has to change
+        self.target_duration = max(1, math.ceil(max(self.durations, default=1)))
+        self.published = 0
+        self._finished = False
+        self._pending = {}
+        os.makedirs(directory, exist_ok=True)
+        self._write_playlist()
+
+    @property
+    def playlist_path(self):
+        return os.path.join(self.directory, PLAYLIST_NAME)
+
+    def add(self, index, video_file):
+        """Record a finished video segment and publish it and any later ones that were waiting on it"""
+        self._pending[index] = video_file
+        published = self.published
+        while self.published in self._pending:
+            self._publish(self.published, self._pending.pop(self.published))
+            self.published += 1
+        if self.published != published:
+            self._write_playlist()
+
+    def _publish(self, index, video_file):
+        # Each segment carries its own slice of the soundtrack, offset so timestamps run on across segments
+        start, duration = self.starts[index], self.durations[index]
+        segment_file = os.path.join(self.directory, f"segment_{index:04d}.ts")
+        mux_audio(
+            ['-i', video_file], self.timeline.section(start, duration), segment_file,
+            output_args=('-output_ts_offset', f"{start + TIMESTAMP_OFFSET:.6f}", '-f', 'mpegts')
+        )
+
+    def finish(self):
+        """Mark the playlist complete so players stop polling it"""
+        self._finished = True
+        self._write_playlist()
+
+    def _write_playlist(self):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-PLAYLIST-TYPE:EVENT',
+            f'#EXT-X-TARGETDURATION:{self.target_duration}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+        ]
+        for index in range(self.published):
+            lines.append(f'#EXTINF:{self.durations[index]:.6f},')
+            lines.append(f'segment_{index:04d}.ts')
+        if self._finished:
+            lines.append('#EXT-X-ENDLIST')
+
+        # Replace atomically so players never read a half-written playlist
+        staging = self.playlist_path + '.tmp'
+        with open(staging, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(staging, self.playlist_path)
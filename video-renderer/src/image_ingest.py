@@ -0,0 +1,163 @@
+import base64
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from asset_cache import DecodedImage, alpha_bbox, asset_cache
+from frame_store import payload_store
+
+# Threads decoding the distinct images of one /render payload
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 4))
+
+
+def decode_image_payload(base64_data):
+    """Decode and validate a base64 image (optionally a data URL) into an RGBA uint8 array.
+
+    PNGs with an alpha channel keep their transparency; other images with transparency are
+    flattened onto white, as they were when payload images were written out as temp files.
+    """
+    # Handle data URL format
+    if base64_data.startswith('data:image'):
+        if ',' not in base64_data:
+            raise ValueError("Data URL missing comma separator")
+        header, base64_data = base64_data.split(',', 1)
+
+    file_data = base64.b64decode(base64_data)
+    with Image.open(io.BytesIO(file_data)) as img:
+        img.load()
+        print(f"Image validation successful: {img.format} {img.size} {img.mode} ({len(file_data)} bytes)")
+        if img.format == 'PNG' and img.mode in ('RGBA', 'LA'):
+            return np.array(img.convert('RGBA'))
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # Flatten transparency onto a white background
+            background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+            background.alpha_composite(img.convert('RGBA'))
+            return np.array(background)
+        return np.array(img.convert('RGBA'))
+
+
+def normalize_rgba(rgba, size=None, width=None):
+    """Resize a decoded image once to what the renderer will ask of it.
+
+    size=(w, h) resizes to exactly that size, as backgrounds are drawn; width only ever shrinks
+    the image to at most that width, keeping its aspect ratio, as sprites are later resized to fit.
+    Returns a read-only, C-contiguous RGBA uint8 array, the format the compositor reads.
+    """
+    height, image_width = rgba.shape[:2]
+    if size is None and width is not None and image_width > width:
+        size = (width, height * width / image_width)
+    if size is not None:
+        size = tuple(max(1, int(value)) for value in size)
+        if size != (image_width, height):
+            # reducing_gap shrinks by whole factors first, which makes downscaling a 4K upload cheap
+            rgba = np.array(Image.fromarray(rgba).resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0))
+    rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+    rgba.flags.writeable = False
+    return rgba
+
+
+class PayloadImages:
+    """The distinct base64 images of one request, keyed by a hash of their payload string.
+
+    Every image is registered with the size it will be drawn at (see normalize_rgba), so an
+    oversized upload is decoded once and scaled down once here, instead of being carried at full
+    resolution into the render. The normalized pixels go to the payload store, which worker
+    processes map by name.
+    """
+
+    def __init__(self, workers=INGEST_WORKERS):
+        self.workers = workers
+        self.references = 0
+        self._payloads = {}
+        self._images = {}
+
+    def add(self, base64_data, size=None, width=None):
+        """Register a payload string and the size it is needed at, and return its key.
+
+        Repeated payloads are decoded once; repeated payloads needed at the same size share one key.
+        """
+        digest = hashlib.sha1(base64_data.encode('utf-8')).hexdigest()
+        self._payloads.setdefault(digest, base64_data)
+        self.references += 1
+        key = (digest, tuple(size) if size else None, width)
+        self._images.setdefault(key, None)
+        return key
+
+    def decode_all(self):
+        """Decode every distinct payload once and normalize it for each use, concurrently.
+
+        Normalized images are kept in the shared asset cache, keyed by payload digest and size, so a
+        payload sent again with a later request is neither decoded nor resized again. Images that
+        fail to decode map to None.
+        """
+        keys = list(self._images)
+        if not keys:
+            return self
+        for key in keys:
+            rgba = asset_cache.get(payload_cache_key(key))
+            if rgba is not None:
+                self._images[key] = stored_image(key, rgba)
+        missing = [key for key in keys if self._images[key] is None]
+        digests = list(dict.fromkeys(key[0] for key in missing))
+        if digests:
+            workers = max(1, min(self.workers, len(missing)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                decoded = dict(zip(digests, pool.map(self._decode, digests)))
+                for key, image in zip(missing, pool.map(lambda key: self._normalize(key, decoded[key[0]]), missing)):
+                    self._images[key] = image
+        print(f"Decoded {len(digests)} distinct images for {self.references} image references "
+              f"({len(keys) - len(missing)} reused from the asset cache)")
+        return self
+
+    def _decode(self, digest):
+        try:
+            return decode_image_payload(self._payloads[digest])
+        except Exception as e:
+            print(f"Invalid image data: {e}")
+            return None
+
+    def _normalize(self, key, rgba):
+        if rgba is None:
+            return None
+        digest, size, width = key
+        normalized = normalize_rgba(rgba, size=size, width=width)
+        if normalized.shape != rgba.shape:
+            print(f"Normalized image {digest[:12]} from {rgba.shape[1]}x{rgba.shape[0]} "
+                  f"to {normalized.shape[1]}x{normalized.shape[0]}")
+        image = stored_image(key, normalized)
+        asset_cache.put(payload_cache_key(key), image.rgba)
+        return image
+
+    def get(self, key):
+        """The DecodedImage for key, or None if it failed to decode"""
+        return self._images.get(key)
+
+
+def payload_cache_key(key):
+    """The asset cache key of a payload image normalized for one use"""
+    digest, size, width = key
+    return ('payload', digest, size, width)
+
+
+def stored_image(key, rgba):
+    """Wrap a payload image normalized for one use, writing it to the payload store unless it is there.
+
+    The image is backed by its store mapping when the store holds it, and by rgba otherwise.
+    """
+    digest, size, width = key
+    store_entry = None
+    if payload_store.enabled:
+        source, variant = f"payload:{digest}", f"rgba-{size}-{width}"
+        name = payload_store.entry_name(source, variant, digest)
+        if not payload_store.touch(name):
+            arrays, _ = payload_store.get_or_build(source, variant, digest, lambda: ({'rgba': rgba}, {}))
+            rgba = arrays['rgba']
+        if payload_store.open_entry(name) is not None:
+            store_entry = name
+    height, width = rgba.shape[:2]
+    # The digest names these exact pixels, so caches never mix up two sizes of one upload
+    return DecodedImage(rgba, f"{digest}:{width}x{height}", bbox=alpha_bbox(rgba), store_entry=store_entry)
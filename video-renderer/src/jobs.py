@@ -0,0 +1,375 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+# Renders running at once, and renders allowed to wait behind them
+RENDER_JOB_WORKERS = int(os.environ.get('RENDER_JOB_WORKERS', 2))
+RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE', 8))
+# Finished jobs remembered for status lookups
+FINISHED_JOBS_KEPT = int(os.environ.get('FINISHED_JOBS_KEPT', 200))
+# Admission control on estimated render seconds (0 disables): the largest single render, and the
+# most work that may be waiting or running, per worker, when a new render is accepted
+RENDER_MAX_JOB_SECONDS = float(os.environ.get('RENDER_MAX_JOB_SECONDS', 0))
+RENDER_MAX_BACKLOG_SECONDS = float(os.environ.get('RENDER_MAX_BACKLOG_SECONDS', 1800))
+# Shortest job first with aging: every second a job waits takes this many seconds off its
+# estimated cost when picking the next job, so a long render is not starved by a stream of short ones
+RENDER_AGING_RATE = float(os.environ.get('RENDER_AGING_RATE', 1.0))
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+
+class RenderCancelled(Exception):
+    """Raised inside a render when its job has been cancelled"""
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the render queue is at capacity"""
+
+
+class JobTooLarge(Exception):
+    """Raised when a job's estimated cost exceeds what a single render may take"""
+
+
+class RenderJob:
+    """State, progress and result of one queued render"""
+
+    def __init__(self, run, cleanup=None, estimated_seconds=None):
+        self.id = uuid.uuid4().hex
+        # Predicted render time, which orders the queue; None sorts as the cheapest
+        self.estimated_seconds = estimated_seconds
+        self.status = JOB_QUEUED
+        self.progress = {
+            'storyboards_done': 0,
+            'storyboards_total': 0,
+            'frames_encoded': 0,
+            'frames_total': 0,
+        }
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._run = run
+        self._cleanup = cleanup
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def update_progress(self, **fields):
+        with self._lock:
+            self.progress.update(fields)
+
+    def advance(self, field, amount=1):
+        with self._lock:
+            self.progress[field] += amount
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Abort the render in progress if the job was cancelled"""
+        if self._cancel_event.is_set():
+            raise RenderCancelled(f"Render job {self.id} was cancelled")
+
+    def remaining_seconds(self, now=None):
+        """Estimated seconds of work left: the whole estimate while queued, scaled by progress once running"""
+        if self.estimated_seconds is None:
+            return 0.0
+        with self._lock:
+            if self.status in FINISHED_STATES:
+                return 0.0
+            if self.status != JOB_RUNNING:
+                return self.estimated_seconds
+            if self.progress['frames_total']:
+                done = self.progress['frames_encoded'] / self.progress['frames_total']
+                return self.estimated_seconds * (1.0 - done)
+            elapsed = (now or time.time()) - self.started_at
+            return max(0.0, self.estimated_seconds - elapsed)
+
+    def to_dict(self, schedule=None):
+        """The job's state; schedule, from RenderJobQueue.schedule(), adds its estimated start and completion"""
+        with self._lock:
+            state = {
+                'job_id': self.id,
+                'status': self.status,
+                'progress': dict(self.progress),
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'estimated_seconds': None if self.estimated_seconds is None else round(self.estimated_seconds, 3),
+            }
+        if schedule is not None and self.id in schedule:
+            start, completion = schedule[self.id]
+            state['estimated_start_at'] = start
+            state['estimated_completion_at'] = completion
+        return state
+
+
+class RenderBatch:
+    """Render jobs submitted together, such as the episodes of a series, with one combined status"""
+
+    def __init__(self, jobs):
+        self.id = uuid.uuid4().hex
+        self.jobs = jobs
+        self.created_at = time.time()
+
+    @property
+    def status(self):
+        statuses = [job.status for job in self.jobs]
+        if not all(status in FINISHED_STATES for status in statuses):
+            return JOB_QUEUED if all(status == JOB_QUEUED for status in statuses) else JOB_RUNNING
+        for status in (JOB_SUCCEEDED, JOB_CANCELLED, JOB_FAILED):
+            if all(job_status == status for job_status in statuses):
+                return status
+        # Some episodes finished and some did not
+        return 'partial'
+
+    @property
+    def finished(self):
+        return all(job.status in FINISHED_STATES for job in self.jobs)
+
+    def to_dict(self, schedule=None):
+        episodes = [job.to_dict(schedule) for job in self.jobs]
+        counts = {}
+        progress = {}
+        for episode in episodes:
+            counts[episode['status']] = counts.get(episode['status'], 0) + 1
+            for field, value in episode['progress'].items():
+                progress[field] = progress.get(field, 0) + value
+        finished_at = [episode['finished_at'] for episode in episodes]
+        return {
+            'batch_id': self.id,
+            'status': self.status,
+            'counts': counts,
+            'progress': progress,
+            'episodes': episodes,
+            'created_at': self.created_at,
+            'finished_at': max(finished_at) if None not in finished_at else None,
+            'estimated_completion_at': max(
+                (episode.get('estimated_completion_at') or 0 for episode in episodes), default=0
+            ) or None,
+        }
+
+
+class RenderJobQueue:
+    """Bounded queue of render jobs served by a fixed pool of worker threads.
+
+    Jobs carry an estimated cost. Workers take the job with the lowest cost less RENDER_AGING_RATE
+    times its wait so far (shortest job first, with aging), and submissions are refused when the
+    estimated work already accepted is too large.
+    """
+
+    def __init__(self, workers=RENDER_JOB_WORKERS, max_queued=RENDER_QUEUE_SIZE,
+                 max_job_seconds=RENDER_MAX_JOB_SECONDS, max_backlog_seconds=RENDER_MAX_BACKLOG_SECONDS,
+                 aging_rate=RENDER_AGING_RATE):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_job_seconds = max_job_seconds
+        self.max_backlog_seconds = max_backlog_seconds
+        self.aging_rate = aging_rate
+        self._pending = []
+        self._jobs = OrderedDict()
+        self._batches = OrderedDict()
+        self._running = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"render-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, run, cleanup=None, estimated_seconds=None):
+        """Queue run(job) and return the job.
+
+        Raises QueueFull when the queue or the estimated backlog is at capacity, and JobTooLarge
+        when estimated_seconds alone is over the limit.
+        """
+        return self._enqueue([RenderJob(run, cleanup, estimated_seconds)])[0]
+
+    def submit_batch(self, runs):
+        """Queue every (run, cleanup, estimated_seconds) triple, or none of them, and return the RenderBatch.
+
+        Raises like submit() unless the whole batch is admitted.
+        """
+        jobs = self._enqueue([RenderJob(run, cleanup, estimated_seconds) for run, cleanup, estimated_seconds in runs])
+        batch = RenderBatch(jobs)
+        with self._lock:
+            self._batches[batch.id] = batch
+        return batch
+
+    def _enqueue(self, jobs):
+        estimated = sum(job.estimated_seconds or 0.0 for job in jobs)
+        with self._available:
+            free = self.max_queued - len(self._pending)
+            if len(jobs) > free:
+                raise QueueFull(f"Render queue has room for {free} jobs, got {len(jobs)}")
+            for job in jobs:
+                if self.max_job_seconds and (job.estimated_seconds or 0.0) > self.max_job_seconds:
+                    raise JobTooLarge(
+                        f"Render is estimated at {job.estimated_seconds:.0f}s, over the {self.max_job_seconds:.0f}s limit"
+                    )
+            backlog = self._backlog_seconds()
+            if self.max_backlog_seconds and backlog > 0 and (backlog + estimated) / self.workers > self.max_backlog_seconds:
+                raise QueueFull(
+                    f"Render backlog is {backlog:.1f}s of estimated work; adding {estimated:.1f}s would exceed "
+                    f"{self.max_backlog_seconds:.0f}s per worker"
+                )
+            for job in jobs:
+                self._pending.append(job)
+                self._jobs[job.id] = job
+            self._forget_finished()
+            self._available.notify(len(jobs))
+        return jobs
+
+    def _backlog_seconds(self):
+        now = time.time()
+        return sum(job.remaining_seconds(now) for job in self._jobs.values() if job.status not in FINISHED_STATES)
+
+    def _priority(self, job, now):
+        return ((job.estimated_seconds or 0.0) - self.aging_rate * (now - job.created_at), job.created_at)
+
+    def _pending_in_order(self, now):
+        return sorted(self._pending, key=lambda job: self._priority(job, now))
+
+    def schedule(self):
+        """{job_id: (estimated start, estimated completion)} for running and queued jobs, as Unix times.
+
+        Queued jobs are assigned, in the order they would be picked now, to whichever worker frees up first.
+        """
+        now = time.time()
+        with self._lock:
+            running = [job for job in self._jobs.values() if job.status == JOB_RUNNING]
+            pending = [job for job in self._pending_in_order(now) if not job.cancelled]
+        schedule = {}
+        free_at = []
+        for job in running:
+            finish = now + job.remaining_seconds(now)
+            schedule[job.id] = (job.started_at, finish)
+            free_at.append(finish)
+        free_at = sorted(free_at + [now] * max(0, self.workers - len(free_at)))
+        for job in pending:
+            start = free_at.pop(0)
+            finish = start + job.remaining_seconds(now)
+            schedule[job.id] = (start, finish)
+            free_at.append(finish)
+            free_at.sort()
+        return schedule
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def cancel_batch(self, batch_id):
+        """Cancel every unfinished job of a batch; returns the batch, or None if it is unknown"""
+        batch = self.get_batch(batch_id)
+        if batch is None:
+            return None
+        for job in batch.jobs:
+            self.cancel(job.id)
+        return batch
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns the job, or None if it is unknown"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job._lock:
+            if job.status in FINISHED_STATES:
+                return job
+            job._cancel_event.set()
+            if job.status != JOB_QUEUED:
+                return job
+            job.status = JOB_CANCELLED
+            job.finished_at = time.time()
+        # Free its place in the queue now; if a worker has just taken it, the worker skips it and cleans up
+        with self._lock:
+            dequeued = job in self._pending
+            if dequeued:
+                self._pending.remove(job)
+        if dequeued:
+            self._clean_up(job)
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': len(self._pending),
+                'max_queued': self.max_queued,
+                'backlog_seconds': round(self._backlog_seconds(), 3),
+            }
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self._jobs[job_id]
+        finished = [batch_id for batch_id, batch in self._batches.items() if batch.finished]
+        for batch_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self._batches[batch_id]
+
+    def _worker(self):
+        while True:
+            with self._available:
+                while not self._pending:
+                    self._available.wait()
+                job = min(self._pending, key=lambda job: self._priority(job, time.time()))
+                self._pending.remove(job)
+            self._execute(job)
+
+    def _execute(self, job):
+        with job._lock:
+            skip = job.status == JOB_CANCELLED
+            if not skip:
+                job.status = JOB_RUNNING
+                job.started_at = time.time()
+
+        if not skip:
+            with self._lock:
+                self._running += 1
+            try:
+                result = job._run(job)
+                status, error = JOB_SUCCEEDED, None
+            except RenderCancelled:
+                result, status, error = None, JOB_CANCELLED, None
+                print(f"Render job {job.id} cancelled")
+            except Exception as e:
+                print(f"Render job {job.id} failed: {e}")
+                traceback.print_exc()
+                result, status, error = None, JOB_FAILED, str(e)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+            with job._lock:
+                job.result = result
+                job.status = status
+                job.error = error
+                job.finished_at = time.time()
+
+        self._clean_up(job)
+
+    def _clean_up(self, job):
+        if job._cleanup:
+            try:
+                job._cleanup()
+            except Exception as e:
+                print(f"Error cleaning up render job {job.id}: {e}")
@@ -0,0 +1,127 @@
+import os
+import shutil
+import threading
+import time
+
+# Rendered videos kept on disk: at most OUTPUTS_MAX_BYTES in total (default 10 GB), and none
+# that have gone unrequested for longer than OUTPUTS_MAX_AGE seconds (default 7 days)
+OUTPUTS_MAX_BYTES = int(os.environ.get('OUTPUTS_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+OUTPUTS_MAX_AGE = int(os.environ.get('OUTPUTS_MAX_AGE', 7 * 24 * 3600))
+OUTPUTS_SWEEP_INTERVAL = int(os.environ.get('OUTPUTS_SWEEP_INTERVAL', 300))
+# Files written to this recently may still be in progress and are never evicted
+OUTPUTS_GRACE_PERIOD = 600
+
+
+class OutputRetention:
+    """Background sweeper that evicts the least recently served renders by age and total size.
+
+    Recency is the file's access time, which touch() bumps on every request; the modification
+    time is left alone so it can keep serving as Last-Modified. A subdirectory, such as a live
+    stream's playlist and segments, counts as one render.
+    """
+
+    def __init__(self, directory, max_bytes=OUTPUTS_MAX_BYTES, max_age=OUTPUTS_MAX_AGE,
+                 interval=OUTPUTS_SWEEP_INTERVAL, label='render output'):
+        self.directory = directory
+        self.label = label
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"{self.label.replace(' ', '-')}-retention", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping {self.label}s: {e}")
+            time.sleep(self.interval)
+
+    def touch(self, path):
+        """Mark a file as just served"""
+        try:
+            stat = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except OSError:
+            pass
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for entry in os.scandir(self.directory):
+            if entry.is_dir():
+                stats = self._file_stats(entry.path)
+            elif entry.is_file():
+                stats = self._file_stats(entry.path, [entry])
+            else:
+                continue
+            if not stats:
+                continue
+            last_used = max(max(stat.st_atime, stat.st_mtime) for stat in stats)
+            mtime = max(stat.st_mtime for stat in stats)
+            entries.append((last_used, sum(stat.st_size for stat in stats), mtime, entry.path))
+        return entries
+
+    def _file_stats(self, path, files=None):
+        stats = []
+        try:
+            for entry in files if files is not None else os.scandir(path):
+                if entry.is_file():
+                    stats.append(entry.stat())
+        except FileNotFoundError:
+            pass
+        return stats
+
+    def _evict(self, path, size):
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+        except FileNotFoundError:
+            return False
+        self.evicted_files += 1
+        self.evicted_bytes += size
+        print(f"Evicted {self.label}: {path} ({size} bytes)")
+        return True
+
+    def sweep(self):
+        """Delete expired renders, then the least recently used ones until under the size cap"""
+        with self._lock:
+            now = time.time()
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _, _ in entries)
+            kept = []
+            for last_used, size, mtime, path in entries:
+                evictable = now - mtime > OUTPUTS_GRACE_PERIOD
+                if evictable and now - last_used > self.max_age and self._evict(path, size):
+                    total -= size
+                else:
+                    kept.append((size, mtime, path))
+
+            for size, mtime, path in kept:
+                if total <= self.max_bytes:
+                    break
+                if now - mtime > OUTPUTS_GRACE_PERIOD and self._evict(path, size):
+                    total -= size
+
+    def stats(self):
+        with self._lock:
+            entries = self._entries()
+            return {
+                'files': len(entries),
+                'bytes': sum(size for _, size, _, _ in entries),
+                'max_bytes': self.max_bytes,
+                'max_age': self.max_age,
+                'evicted_files': self.evicted_files,
+                'evicted_bytes': self.evicted_bytes,
+            }
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+class RenderProfile:
+    """Output resolution, frame rate and x264 settings of one kind of render.
+
+    Layout is authored at base_width; pixel sizes and offsets go through scaled() so the whole
+    compositing path runs at the profile's resolution rather than downscaling at the end.
+    """
+
+    def __init__(self, name, width, height, fps, preset='medium', crf=23, base_width=1280):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.preset = preset
+        self.crf = crf
+        self.scale = width / base_width
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    def scaled(self, value):
+        """A layout size in pixels at this profile's resolution, at least one pixel"""
+        return max(1, int(round(value * self.scale)))
+
+    def frame_count(self, duration):
+        # Tolerate float error so a duration of exactly n frames counts as n
+        return int(np.ceil(duration * self.fps - 1e-6))
+
+    def snap_duration(self, duration):
+        """Round a duration up to a whole number of frames"""
+        return self.frame_count(duration) / self.fps
+
+    def ffmpeg_params(self):
+        return ['-crf', str(self.crf)]
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'width': self.width,
+            'height': self.height,
+            'fps': self.fps,
+            'preset': self.preset,
+            'crf': self.crf,
+        }
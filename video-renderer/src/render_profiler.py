@@ -0,0 +1,121 @@
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# How often the stack sampler looks at the render thread
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+
+# 'deterministic' traces every call with cProfile and also samples stacks; 'sampling' only samples,
+# which costs far less but gives no pstats
+PROFILERS = ('deterministic', 'sampling')
+
+PSTATS_SUFFIX = '.pstats'
+COLLAPSED_SUFFIX = '.collapsed'
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval from a background thread.
+
+    The samples are written in collapsed-stack form, one 'root;...;leaf count' line per distinct
+    stack, which flamegraph.pl, speedscope and most flame graph viewers read directly.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+
+
+# cProfile traces one block at a time: from Python 3.12 it is built on sys.monitoring, which
+# allows a single profiler per process
+_deterministic_lock = threading.Lock()
+
+
+@contextmanager
+def profiling(output_prefix, profiler='deterministic'):
+    """Profile the calling thread for the duration of the block.
+
+    Writes output_prefix + '.collapsed' and, for the deterministic profiler, output_prefix + '.pstats'.
+    Yields a dict that holds the profiler used, the written paths and the wall time once the block
+    is done. The stack sampler follows only this thread, so work in other threads or processes appears
+    as time spent waiting. cProfile records every thread from Python 3.12, so its pstats also hold
+    whatever else the process ran meanwhile. Only one block is traced at a time: while another holds
+    the deterministic profiler, this one is only sampled and the report says 'sampling'.
+    """
+    tracer = None
+    if profiler == 'deterministic':
+        if _deterministic_lock.acquire(blocking=False):
+            tracer = cProfile.Profile()
+        else:
+            print("Deterministic profiler is busy with another render, sampling instead")
+            profiler = 'sampling'
+    locked = tracer is not None
+    report = {'profiler': profiler, 'files': {}}
+    sampler = None
+    start = time.perf_counter()
+    try:
+        sampler = StackSampler(threading.get_ident()).start()
+        if tracer:
+            try:
+                tracer.enable()
+            except ValueError as e:
+                # Another profiling tool, such as a debugger's, holds sys.monitoring
+                print(f"Cannot start deterministic profiler ({e}), sampling instead")
+                tracer = None
+                report['profiler'] = 'sampling'
+        yield report
+    finally:
+        try:
+            if tracer:
+                tracer.disable()
+            if sampler:
+                sampler.stop()
+            report['wall_seconds'] = round(time.perf_counter() - start, 6)
+            report['samples'] = sum(sampler.samples.values()) if sampler else 0
+            try:
+                if tracer:
+                    tracer.dump_stats(output_prefix + PSTATS_SUFFIX)
+                    report['files']['pstats'] = output_prefix + PSTATS_SUFFIX
+                if sampler:
+                    sampler.write_collapsed(output_prefix + COLLAPSED_SUFFIX)
+                    report['files']['collapsed'] = output_prefix + COLLAPSED_SUFFIX
+                print(f"Wrote render profile: {', '.join(report['files'].values())}")
+            except OSError as e:
+                print(f"Error writing render profile {output_prefix}: {e}")
+        finally:
+            if locked:
+                _deterministic_lock.release()
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+# Encoded storyboard segments kept on disk for incremental re-renders (default 2 GB)
+SEGMENT_CACHE_DIR = os.environ.get('SEGMENT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'render_segment_cache'))
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+SEGMENT_SUFFIX = '.mp4'
+
+
+def segment_fingerprint(parts):
+    """Stable hash of everything that determines a segment's encoded bytes"""
+    encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def link_or_copy(src, dst):
+    """Hard-link src to dst, copying when the two are on different filesystems"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class SegmentCache:
+    """Directory of encoded segments named by fingerprint, evicted least recently used first past a byte cap"""
+
+    def __init__(self, directory=SEGMENT_CACHE_DIR, max_bytes=SEGMENT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, fingerprint):
+        return os.path.join(self.directory, fingerprint + SEGMENT_SUFFIX)
+
+    def fetch(self, fingerprint, dst):
+        """Place the cached segment for fingerprint at dst; returns False on a miss"""
+        if not self.enabled:
+            return False
+        path = self._path(fingerprint)
+        with self._lock:
+            try:
+                link_or_copy(path, dst)
+                # mtime is the recency used for eviction
+                os.utime(path)
+            except FileNotFoundError:
+                self.misses += 1
+                return False
+            self.hits += 1
+            return True
+
+    def store(self, fingerprint, src):
+        """Add a freshly encoded segment under fingerprint, then evict down to the byte cap"""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Link under a temporary name first so readers never see a partial file
+        staging = os.path.join(self.directory, f".{fingerprint}.{uuid.uuid4().hex[:8]}.tmp")
+        with self._lock:
+            try:
+                link_or_copy(src, staging)
+                os.replace(staging, self._path(fingerprint))
+            except OSError as e:
+                print(f"Error caching segment {fingerprint}: {e}")
+                if os.path.exists(staging):
+                    os.unlink(staging)
+                return
+            self._evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        # Always keep the newest segment, even if it alone exceeds the cap
+        while total > self.max_bytes and len(entries) > 1:
+            _, size, name = entries.pop(0)
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            entries = self._entries() if os.path.isdir(self.directory) else []
+            return {
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,110 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Stages of a render that the hot path reports time for
+STAGES = ('asset_load', 'composite', 'subtitle', 'audio', 'encode')
+
+_local = threading.local()
+
+
+class StageTimings:
+    """Seconds and call counts per render stage.
+
+    Stages nest: time spent in an inner stage is charged to it and not to the stage around it,
+    so the totals add up to the time spent inside any stage at all.
+
+    Timers are kept apart from stages: each one is charged everything inside it, stages and other
+    timers included, to show what a particular function costs in all.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.timers = {}
+
+    def add(self, stage_name, seconds, calls=1):
+        self.seconds[stage_name] = self.seconds.get(stage_name, 0.0) + seconds
+        self.calls[stage_name] = self.calls.get(stage_name, 0) + calls
+
+    def merge(self, timings):
+        """Add in the to_dict() of timings recorded elsewhere, such as in a worker process"""
+        for stage_name, entry in timings.items():
+            self.add(stage_name, entry['seconds'], entry['calls'])
+
+    def add_timer(self, timer_name, seconds, calls=1):
+        entry = self.timers.setdefault(timer_name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+
+    def merge_timers(self, timers):
+        """Add in the timers_to_dict() of timings recorded elsewhere"""
+        for timer_name, entry in timers.items():
+            self.add_timer(timer_name, entry['seconds'], entry['calls'])
+
+    @property
+    def total(self):
+        return sum(self.seconds.values())
+
+    def to_dict(self):
+        return {
+            stage_name: {'seconds': round(self.seconds[stage_name], 6), 'calls': self.calls[stage_name]}
+            for stage_name in sorted(self.seconds)
+        }
+
+    def timers_to_dict(self):
+        return {
+            timer_name: {'seconds': round(seconds, 6), 'calls': calls}
+            for timer_name, (seconds, calls) in sorted(self.timers.items())
+        }
+
+
+def current():
+    """The timings being recorded on this thread, or None"""
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def recording(timings=None):
+    """Record the stages this thread runs into timings (a new StageTimings by default)"""
+    timings = timings if timings is not None else StageTimings()
+    previous, previous_stack = current(), getattr(_local, 'stack', None)
+    _local.timings, _local.stack = timings, []
+    try:
+        yield timings
+    finally:
+        _local.timings, _local.stack = previous, previous_stack
+
+
+@contextmanager
+def stage(stage_name):
+    """Charge the time spent in the block to stage_name; free when nothing is recording"""
+    timings = current()
+    if timings is None:
+        yield
+        return
+    # [start, seconds spent in nested stages]
+    frame = [time.perf_counter(), 0.0]
+    _local.stack.append(frame)
+    try:
+        yield
+    finally:
+        _local.stack.pop()
+        elapsed = time.perf_counter() - frame[0]
+        timings.add(stage_name, elapsed - frame[1])
+        if _local.stack:
+            _local.stack[-1][1] += elapsed
+
+
+@contextmanager
+def timer(timer_name):
+    """Charge the whole time spent in the block to timer_name; free when nothing is recording"""
+    timings = current()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add_timer(timer_name, time.perf_counter() - start)
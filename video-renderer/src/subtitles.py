@@ -0,0 +1,104 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Actual font file paths that are available in the Docker container, in order of preference
+FONT_OPTIONS = [
+    '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',      # WenQuanYi Zen Hei
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',    # WenQuanYi Micro Hei
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',  # Noto Sans CJK
+    '/usr/share/fonts/truetype/arphic/ukai.ttc',         # AR PL UKai
+    '/usr/share/fonts/truetype/arphic/uming.ttc',        # AR PL UMing
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',   # DejaVu Sans
+]
+
+# Number of distinct rasterized subtitles kept in memory
+SUBTITLE_CACHE_SIZE = int(os.environ.get('SUBTITLE_CACHE_SIZE', 512))
+
+
+def resolve_font(font_options=FONT_OPTIONS):
+    """Return the first font file that exists and loads, or None for the default font"""
+    for font_path in font_options:
+        if not os.path.exists(font_path):
+            print(f"Font file not found: {font_path}")
+            continue
+        try:
+            ImageFont.truetype(font_path, 40)
+            print(f"Using subtitle font: {font_path}")
+            return font_path
+        except Exception as font_error:
+            print(f"Font {font_path} failed: {font_error}")
+    print("Using default system font for subtitles")
+    return None
+
+
+class SubtitleRasterizer:
+    """Rasterizes subtitle text once into tight RGB + alpha bitmaps, kept in a bounded LRU cache"""
+
+    def __init__(self, font_path, max_entries=SUBTITLE_CACHE_SIZE):
+        self.font_path = font_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._fonts = {}
+        self._bitmaps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _font(self, fontsize):
+        font = self._fonts.get(fontsize)
+        if font is None:
+            if self.font_path:
+                font = ImageFont.truetype(self.font_path, fontsize)
+            else:
+                font = ImageFont.load_default(size=fontsize)
+            self._fonts[fontsize] = font
+        return font
+
+    def render(self, text, fontsize=40, color='white', stroke_color='black', stroke_width=3):
+        """Return (rgb, alpha) for the text with its stroke, cropped to the inked area"""
+        key = (text, self.font_path, fontsize, color, stroke_color, stroke_width)
+        with self._lock:
+            bitmap = self._bitmaps.get(key)
+            if bitmap is not None:
+                self._bitmaps.move_to_end(key)
+                self.hits += 1
+                return bitmap
+            self.misses += 1
+
+        bitmap = self._rasterize(text, fontsize, color, stroke_color, stroke_width)
+
+        with self._lock:
+            self._bitmaps[key] = bitmap
+            while len(self._bitmaps) > self.max_entries:
+                self._bitmaps.popitem(last=False)
+        return bitmap
+
+    def _rasterize(self, text, fontsize, color, stroke_color, stroke_width):
+        font = self._font(fontsize)
+        probe = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+        left, top, right, bottom = probe.textbbox((0, 0), text, font=font, stroke_width=stroke_width)
+        width, height = max(1, right - left), max(1, bottom - top)
+
+        image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        ImageDraw.Draw(image).text(
+            (-left, -top), text, font=font, fill=color,
+            stroke_width=stroke_width, stroke_fill=stroke_color
+        )
+        rgba = np.array(image)
+        rgb = np.ascontiguousarray(rgba[:, :, :3])
+        alpha = rgba[:, :, 3] / 255.0
+        rgb.flags.writeable = False
+        alpha.flags.writeable = False
+        return rgb, alpha
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._bitmaps),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
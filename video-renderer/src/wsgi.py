@@ -0,0 +1,19 @@
+"""Entry point for serving the renderer with gunicorn.
+
+gunicorn hands whole-file responses (rendered videos, HLS segments) to the kernel with sendfile,
+which the Flask development server cannot do. Run it with one worker process: render jobs, their
+queue and the live streams' state live in that process, so extra concurrency comes from threads.
+
+    gunicorn --chdir src --worker-class gthread --workers 1 --threads 16 --bind 0.0.0.0:5000 wsgi:app
+"""
+import multiprocessing
+
+# The segment pool's forkserver preloads __main__, which is gunicorn here rather than this service;
+# preload the service instead, so segment workers start with the expression bank already loaded
+multiprocessing.set_forkserver_preload(['app'])
+
+from app import app, start_services
+
+__all__ = ['app']
+
+start_services()
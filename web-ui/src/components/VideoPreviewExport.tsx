@@ -1,4 +1,5 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef, type CSSProperties } from 'react'
+import Hls from 'hls.js'
 import { storageManager } from '../utils/storage'
 
 interface AudioData {
@@ -9,6 +10,33 @@ interface AudioData {
   error?: string
 }
 
+const HLS_MIME_TYPE = 'application/vnd.apple.mpegurl'
+
+// Safari plays HLS natively; other browsers need hls.js, which feeds the segments through Media Source Extensions
+function canPlayHls() {
+  return document.createElement('video').canPlayType(HLS_MIME_TYPE) !== '' || Hls.isSupported()
+}
+
+// A video element playing a live HLS playlist, natively where the browser can and through hls.js elsewhere
+function HlsVideo({ src, style }: { src: string, style?: CSSProperties }) {
+  const videoRef = useRef<HTMLVideoElement>(null)
+
+  useEffect(() => {
+    const video = videoRef.current
+    if (!video) return
+    if (video.canPlayType(HLS_MIME_TYPE) !== '') {
+      video.src = src
+      return
+    }
+    const hls = new Hls()
+    hls.loadSource(src)
+    hls.attachMedia(video)
+    return () => hls.destroy()
+  }, [src])
+
+  return <video ref={videoRef} controls autoPlay width="800" style={style} />
+}
+
 export default function VideoPreviewExport() {
   const [parsed, setParsed] = useState<any>(null)
   const [isGenerating, setIsGenerating] = useState(false)
@@ -18,6 +46,9 @@ export default function VideoPreviewExport() {
   const [characterImages, setCharacterImages] = useState<Record<string, string>>({})
   const [backgroundImages, setBackgroundImages] = useState<Record<string, string>>({})
   const [bgmSettings, setBgmSettings] = useState<any>(null)
+  const [renderProgress, setRenderProgress] = useState<any>(null)
+  const [renderProfile, setRenderProfile] = useState<'final' | 'draft'>('final')
+  const [streamUrl, setStreamUrl] = useState<string | null>(null)
 
   // Load all required data from storage on mount
   useEffect(() => {
@@ -91,7 +122,11 @@ export default function VideoPreviewExport() {
     return {
       scenes: enhancedScenes,
       audio_files: audioFiles,
-      bgm: bgmSettings
+      bgm: bgmSettings,
+      // Segmented renders reuse unchanged storyboards from the renderer's cache, and the
+      // streaming mode also publishes them to a live HLS playlist, for browsers that can play one
+      mode: canPlayHls() ? 'streaming' : 'parallel',
+      profile: renderProfile
     }
   }
 
@@ -130,19 +165,42 @@ export default function VideoPreviewExport() {
         body: JSON.stringify(videoData)
       })
 
+      if (response.status === 429) {
+        throw new Error('The video renderer is busy. Please try again in a moment.')
+      }
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`)
       }
 
-      const result = await response.json()
-      console.log('Video render response:', result)
+      const { job_id, stream_url } = await response.json()
+      console.log('Video render job queued:', job_id)
+
+      // Streaming renders can be watched once their first segment is out
+      const canPlayStream = !!stream_url
+
+      // Poll the render job until it finishes
+      let job: any
+      while (true) {
+        await new Promise(resolve => setTimeout(resolve, 1000))
+        const statusResponse = await fetch(`http://localhost:5003/render/jobs/${job_id}`)
+        if (!statusResponse.ok) {
+          throw new Error(`HTTP error! status: ${statusResponse.status}`)
+        }
+        job = await statusResponse.json()
+        setRenderProgress(job.progress)
+        if (canPlayStream && job.progress?.segments_streamed > 0) {
+          setStreamUrl(stream_url)
+        }
+        if (['succeeded', 'failed', 'cancelled'].includes(job.status)) break
+      }
+      console.log('Video render job finished:', job)
 
-      if (result.video_file) {
-        setVideoUrl(result.video_file)
+      if (job.status === 'succeeded' && job.result?.video_file) {
+        setVideoUrl(job.result.video_file)
         // Save to storage for persistence
-        await storageManager.saveData('videoFile', result.video_file)
+        await storageManager.saveData('videoFile', job.result.video_file)
       } else {
-        setError(result.error || 'Failed to generate video')
+        setError(job.error || `Video render ${job.status}`)
       }
     } catch (err: any) {
       console.error('Video generation error:', err)
@@ -153,6 +211,8 @@ export default function VideoPreviewExport() {
       }
     } finally {
       setIsGenerating(false)
+      setRenderProgress(null)
+      setStreamUrl(null)
     }
   }
 
@@ -310,6 +370,23 @@ export default function VideoPreviewExport() {
           )}
         </button>
 
+        <select
+          value={renderProfile}
+          onChange={(e) => setRenderProfile(e.target.value as 'final' | 'draft')}
+          disabled={isGenerating}
+          style={{
+            padding: '12px 12px',
+            background: '#1a1a1a',
+            color: 'white',
+            border: '1px solid #444',
+            borderRadius: 6,
+            fontSize: 14
+          }}
+        >
+          <option value="final">Final (1280x720)</option>
+          <option value="draft">Draft preview (640x360, fast)</option>
+        </select>
+
         {videoUrl && (
           <button 
             onClick={clearVideo}
@@ -358,6 +435,20 @@ export default function VideoPreviewExport() {
             <span>⏳</span>
             Generating your anime video... This may take several minutes depending on the length and complexity.
           </div>
+          {renderProgress && (
+            <div style={{ marginTop: 8 }}>
+              Storyboards: {renderProgress.storyboards_done}/{renderProgress.storyboards_total}
+              {renderProgress.frames_total > 0 && (
+                <> · Frames: {renderProgress.frames_encoded}/{renderProgress.frames_total}</>
+              )}
+            </div>
+          )}
+          {streamUrl && (
+            <HlsVideo
+              style={{ maxWidth: '100%', borderRadius: 6, marginTop: 12 }}
+              src={`http://localhost:5003${streamUrl}`}
+            />
+          )}
         </div>
       )}
 